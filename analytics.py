@@ -0,0 +1,253 @@
+import numpy as np
+
+from token_index import NO_TERM, normalize_token
+
+
+def log_likelihood(a, b, c, d):
+    """Log-likelihood (G2) keyness of counts ``a`` in a corpus of ``c`` tokens against ``b`` in ``d``.
+
+    Works elementwise on arrays. The statistic is signed: positive where the
+    term is relatively more frequent in the first corpus.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    expected_a = c * (a + b) / (c + d)
+    expected_b = d * (a + b) / (c + d)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g2 = 2 * (np.where(a > 0, a * np.log(a / expected_a), 0) + np.where(b > 0, b * np.log(b / expected_b), 0))
+    return np.where(a / c >= b / d, g2, -g2)
+
+
+def log_ratio(a, b, c, d):
+    """Binary log of the ratio of relative frequencies, with 0.5 added to zero counts."""
+    a = np.where(a > 0, a, 0.5)
+    b = np.where(b > 0, b, 0.5)
+    return np.log2((a / c) / (b / d))
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=int)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class CorpusAnalytics:
+    """Term-document statistics of the corpus, computed with NumPy arrays.
+
+    Built once per corpus from the token index. Every edition's token
+    stream becomes an integer array, tagged with the scene each token
+    belongs to. Documents are editions or scenes; their term counts are
+    kept as a sparse matrix in CSR form (row offsets, term ids, counts),
+    with a dense edition x vocabulary matrix alongside for keyness.
+    N-gram tables are computed on first use per edition and kept.
+    """
+
+    def __init__(self, token_index, edition_scenes):
+        self.vocabulary = token_index.vocabulary
+        self.term_ids = token_index.term_ids
+        self.editions = list(token_index.editions)
+        self.edition_index = {edition: i for i, edition in enumerate(self.editions)}
+        vocabulary_size = len(self.vocabulary)
+
+        # Token streams and the scene document of every token
+        self.tokens = {}
+        self.token_scenes = {}
+        self.scenes = []
+        self.edition_scene_range = {}
+        for edition_id, data in token_index.editions.items():
+            tokens = np.asarray(data['tokens'], dtype=np.int64)
+            line_offsets = np.asarray(data['line_offsets'], dtype=np.int64)
+            line_of_token = np.repeat(np.arange(len(line_offsets) - 1), np.diff(line_offsets))
+            line_scene = np.full(len(line_offsets) - 1, -1, dtype=np.int64)
+            first_scene = len(self.scenes)
+            for act, scene, lines in edition_scenes.get(edition_id, []):
+                line_scene[lines] = len(self.scenes)
+                self.scenes.append((edition_id, act, scene))
+            self.edition_scene_range[edition_id] = (first_scene, len(self.scenes))
+            self.tokens[edition_id] = tokens
+            self.token_scenes[edition_id] = line_scene[line_of_token]
+
+        # Edition x term counts
+        self.edition_counts = np.zeros((len(self.editions), vocabulary_size), dtype=np.int64)
+        for i, edition_id in enumerate(self.editions):
+            tokens = self.tokens[edition_id]
+            self.edition_counts[i] = np.bincount(tokens[tokens != NO_TERM], minlength=vocabulary_size)
+        self.edition_lengths = self.edition_counts.sum(axis=1)
+
+        # Scene x term counts as CSR: unique (scene, term) keys sorted by scene, then term
+        keys = []
+        for edition_id in self.editions:
+            tokens, scenes = self.tokens[edition_id], self.token_scenes[edition_id]
+            valid = (tokens != NO_TERM) & (scenes >= 0)
+            keys.append(scenes[valid] * vocabulary_size + tokens[valid])
+        keys, counts = np.unique(np.concatenate(keys) if keys else np.array([], dtype=np.int64), return_counts=True)
+        rows = keys // vocabulary_size
+        self.scene_terms = keys % vocabulary_size
+        self.scene_term_counts = counts
+        self.scene_offsets = np.searchsorted(rows, np.arange(len(self.scenes) + 1))
+        self.scene_lengths = np.bincount(rows, weights=counts, minlength=len(self.scenes))
+
+        # Document frequencies for TF-IDF over either kind of document
+        self.edition_df = (self.edition_counts > 0).sum(axis=0)
+        self.scene_df = np.bincount(self.scene_terms, minlength=vocabulary_size)
+
+        self.ngram_cache = {}
+
+    def __contains__(self, edition_id):
+        return edition_id in self.edition_index
+
+    def keyness(self, edition_id, reference=None, k=30):
+        """Terms most over- and underused in an edition, by log-likelihood.
+
+        The reference corpus is another edition, or by default every other
+        edition together.
+        """
+        i = self.edition_index[edition_id]
+        target = self.edition_counts[i]
+        if reference:
+            reference_counts = self.edition_counts[self.edition_index[reference]]
+        else:
+            reference_counts = self.edition_counts.sum(axis=0) - target
+        c, d = target.sum(), reference_counts.sum()
+        g2 = log_likelihood(target, reference_counts, c, d)
+        ratio = log_ratio(target, reference_counts, c, d)
+
+        def rows(indices):
+            return [
+                {
+                    'term': self.vocabulary[t],
+                    'count': int(target[t]),
+                    'reference_count': int(reference_counts[t]),
+                    'log_likelihood': round(float(abs(g2[t])), 2),
+                    'log_ratio': round(float(ratio[t]), 2),
+                }
+                for t in indices
+            ]
+        return {'overused': rows(top_k(g2, k)), 'underused': rows(top_k(-g2, k))}
+
+    def tfidf(self, edition_id, unit='edition', k=20):
+        """Highest TF-IDF terms of an edition, or of each of its scenes.
+
+        Term frequency is the count divided by the document length; inverse
+        document frequency is ``log(N / df)`` over all documents of the unit.
+        """
+        if unit == 'scene':
+            first, last = self.edition_scene_range[edition_id]
+            idf = np.log(len(self.scenes) / np.maximum(self.scene_df, 1))
+            results = []
+            for s in range(first, last):
+                start, end = self.scene_offsets[s], self.scene_offsets[s + 1]
+                terms = self.scene_terms[start:end]
+                scores = self.scene_term_counts[start:end] / max(self.scene_lengths[s], 1) * idf[terms]
+                _, act, scene = self.scenes[s]
+                results.append({
+                    'act': act,
+                    'scene': scene,
+                    'terms': [
+                        {'term': self.vocabulary[terms[j]], 'count': int(self.scene_term_counts[start + j]),
+                         'tfidf': round(float(scores[j]), 5)}
+                        for j in top_k(scores, k)
+                    ],
+                })
+            return results
+        i = self.edition_index[edition_id]
+        idf = np.log(len(self.editions) / np.maximum(self.edition_df, 1))
+        scores = self.edition_counts[i] / max(self.edition_lengths[i], 1) * idf
+        return [
+            {'act': None, 'scene': None, 'terms': [
+                {'term': self.vocabulary[t], 'count': int(self.edition_counts[i, t]), 'tfidf': round(float(scores[t]), 5)}
+                for t in top_k(scores, k) if scores[t] > 0
+            ]}
+        ]
+
+    def collocations(self, keyword, edition_id=None, window=5, k=30, min_count=2):
+        """Words occurring within ``window`` tokens of a keyword, ranked by log-likelihood.
+
+        Windows stay within a scene, and a token in several windows counts
+        once. Each collocate is scored against its
+        frequency in the editions searched, with the words in all windows as
+        the first corpus and the rest of the text as the second.
+        """
+        term_id = self.term_ids.get(normalize_token(keyword))
+        edition_ids = [edition_id] if edition_id else self.editions
+        vocabulary_size = len(self.vocabulary)
+        neighbours = np.zeros(vocabulary_size, dtype=np.int64)
+        window_tokens = 0
+        totals = np.zeros(vocabulary_size, dtype=np.int64)
+        occurrences = 0
+        for edition in edition_ids:
+            totals += self.edition_counts[self.edition_index[edition]]
+            if term_id is None:
+                continue
+            tokens, scenes = self.tokens[edition], self.token_scenes[edition]
+            positions = np.flatnonzero(tokens == term_id)
+            occurrences += len(positions)
+            offsets = np.concatenate([np.arange(-window, 0), np.arange(1, window + 1)])
+            around = positions[:, None] + offsets[None, :]
+            inside = (around >= 0) & (around < len(tokens))
+            around = np.where(inside, around, 0)
+            keep = inside & (scenes[around] == scenes[positions][:, None]) & (tokens[around] != NO_TERM)
+            # Tokens in overlapping windows are counted once
+            collocates = tokens[np.unique(around[keep])]
+            neighbours += np.bincount(collocates, minlength=vocabulary_size)
+            window_tokens += len(collocates)
+        if not window_tokens:
+            return {'occurrences': occurrences, 'collocates': []}
+
+        rest = totals - neighbours
+        rest[term_id] -= min(rest[term_id], occurrences)
+        c, d = window_tokens, max(rest.sum(), 1)
+        g2 = log_likelihood(neighbours, rest, c, d)
+        g2[neighbours < min_count] = -np.inf
+        g2[term_id] = -np.inf
+        return {
+            'occurrences': occurrences,
+            'collocates': [
+                {
+                    'term': self.vocabulary[t],
+                    'count': int(neighbours[t]),
+                    'total': int(totals[t]),
+                    'log_likelihood': round(float(g2[t]), 2),
+                }
+                for t in top_k(g2, k) if np.isfinite(g2[t]) and g2[t] > 0
+            ],
+        }
+
+    def _ngram_table(self, edition_id, n):
+        """Distinct n-grams of an edition and their counts, most frequent first."""
+        cached = self.ngram_cache.get((edition_id, n))
+        if cached is not None:
+            return cached
+        tokens, scenes = self.tokens[edition_id], self.token_scenes[edition_id]
+        vocabulary_size = len(self.vocabulary)
+        count = len(tokens) - n + 1
+        if count <= 0:
+            table = (np.zeros((0, n), dtype=np.int64), np.zeros(0, dtype=np.int64))
+        else:
+            # N-grams skip punctuation-only words and never cross a scene boundary
+            grams = np.stack([tokens[j:j + count] for j in range(n)], axis=1)
+            valid = (grams != NO_TERM).all(axis=1) & (scenes[:count] == scenes[n - 1:n - 1 + count])
+            keys = np.zeros(valid.sum(), dtype=np.int64)
+            for j in range(n):
+                keys = keys * vocabulary_size + grams[valid, j]
+            keys, counts = np.unique(keys, return_counts=True)
+            order = np.argsort(-counts, kind='stable')
+            keys, counts = keys[order], counts[order]
+            grams = np.zeros((len(keys), n), dtype=np.int64)
+            for j in range(n - 1, -1, -1):
+                grams[:, j] = keys % vocabulary_size
+                keys = keys // vocabulary_size
+            table = (grams, counts)
+        self.ngram_cache[(edition_id, n)] = table
+        return table
+
+    def ngrams(self, edition_id, n=2, k=30):
+        """The ``k`` most frequent n-grams of an edition."""
+        grams, counts = self._ngram_table(edition_id, n)
+        return [
+            {'ngram': ' '.join(self.vocabulary[t] for t in gram), 'count': int(count)}
+            for gram, count in zip(grams[:k], counts[:k])
+        ]
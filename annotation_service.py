@@ -0,0 +1,309 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, Index, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
+
+Base = declarative_base()
+
+class Annotation(Base):
+    __tablename__ = 'annotations'
+    __table_args__ = (
+        # Annotations are always looked up by the line they belong to
+        Index('ix_annotations_location', 'edition', 'act', 'scene', 'speaker', 'line_number'),
+    )
+    id = Column(Integer, primary_key=True)  # PostgreSQL will use SERIAL by default
+    edition = Column(String(100))
+    act = Column(String(10))
+    scene = Column(String(10))
+    speaker = Column(String(100))
+    line_number = Column(String(10))
+    text = Column(Text)
+
+# Database used when DATABASE_URL is not set
+DEFAULT_SQLITE_PATH = 'annotations.db'
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    id INTEGER NOT NULL,
+    edition VARCHAR(100),
+    act VARCHAR(10),
+    scene VARCHAR(10),
+    speaker VARCHAR(100),
+    line_number VARCHAR(10),
+    text TEXT,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_annotations_location ON annotations (edition, act, scene, speaker, line_number);
+"""
+
+# Columns a client may set, with their maximum length (None for unbounded text)
+ANNOTATION_FIELDS = {
+    column.name: getattr(column.type, 'length', None)
+    for column in Annotation.__table__.columns if column.name != 'id'
+}
+
+
+def clean_annotation(data):
+    """Validate an annotation posted by a client, keeping only the known columns."""
+    if not isinstance(data, dict):
+        raise ValueError("An annotation must be an object.")
+    annotation = {}
+    for name, length in ANNOTATION_FIELDS.items():
+        value = data.get(name)
+        if value is not None and not isinstance(value, str):
+            value = str(value)
+        if length is not None and value is not None and len(value) > length:
+            raise ValueError(f"{name} is longer than {length} characters.")
+        annotation[name] = value
+    # Lines without a number are stored as NULL so they match their entries
+    annotation['line_number'] = annotation['line_number'] or None
+    if not annotation['text'] or not annotation['text'].strip():
+        raise ValueError("Annotation text cannot be empty.")
+    return annotation
+
+def database_url(url):
+    """Normalize a database URL from the environment for SQLAlchemy."""
+    # Fix the database URL scheme if necessary
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    # Add client_encoding parameter
+    if url.startswith("postgresql"):
+        url += "&client_encoding=utf8" if '?' in url else "?client_encoding=utf8"
+    return url
+
+
+def open_store(url=None, on_query=None, **pool_options):
+    """Annotation storage for a database URL.
+
+    No URL selects the local SQLite file ``annotations.db``; ``sqlite://``
+    URLs select the SQLite backend for their file; anything else, usually
+    Postgres, goes through a pooled SQLAlchemy engine configured by
+    ``pool_options``. ``on_query`` is called with the SQL and duration in
+    seconds of every statement the store runs.
+    """
+    if not url:
+        return SQLiteStore(DEFAULT_SQLITE_PATH, on_query=on_query)
+    parsed = make_url(database_url(url))
+    if parsed.get_backend_name() == 'sqlite':
+        return SQLiteStore(parsed.database or ':memory:', on_query=on_query)
+    return PostgresStore(parsed, on_query=on_query, **pool_options)
+
+
+class PostgresStore:
+    """Annotations in a server database, through a pooled SQLAlchemy engine."""
+
+    def __init__(self, url, pool_size=None, max_overflow=None, pool_timeout=None, pool_recycle=None, on_query=None):
+        pool_options = {
+            'pool_size': pool_size,
+            'max_overflow': max_overflow,
+            'pool_timeout': pool_timeout,
+            'pool_recycle': pool_recycle,
+        }
+        self.engine = create_engine(
+            url, pool_pre_ping=True,
+            **{name: value for name, value in pool_options.items() if value is not None}
+        )
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+        if on_query:
+            # Time every statement on the connection that runs it
+            @event.listens_for(self.engine, 'before_cursor_execute')
+            def start_query(connection, cursor, statement, parameters, context, executemany):
+                connection.info.setdefault('query_starts', []).append(time.perf_counter())
+
+            @event.listens_for(self.engine, 'after_cursor_execute')
+            def end_query(connection, cursor, statement, parameters, context, executemany):
+                on_query(statement, time.perf_counter() - connection.info['query_starts'].pop())
+
+    def init_schema(self):
+        """Create the annotations table and its indexes if they do not exist yet."""
+        if not inspect(self.engine).has_table(Annotation.__tablename__):
+            if self.engine.dialect.name == 'postgresql':
+                # A sequence left behind by a dropped table would block creating it again
+                with self.engine.begin() as connection:
+                    connection.execute(text("DROP SEQUENCE IF EXISTS annotations_id_seq;"))
+            Base.metadata.create_all(bind=self.engine)
+            print("Database tables and sequences created.")
+        else:
+            print("Tables already exist.")
+            # Add indexes introduced after the table was first created
+            for index in Annotation.__table__.indexes:
+                index.create(bind=self.engine, checkfirst=True)
+
+    def for_edition(self, edition_id):
+        # Fetch all annotations for the edition in a single query
+        grouped = defaultdict(list)
+        query = self.session.query(Annotation).filter_by(edition=edition_id).order_by(Annotation.id)
+        for annotation in query:
+            key = (annotation.act, annotation.scene, annotation.speaker, annotation.line_number)
+            grouped[key].append(annotation.text)
+        return dict(grouped)
+
+    def insert_many(self, annotations):
+        with self.engine.begin() as connection:
+            connection.execute(Annotation.__table__.insert(), annotations)
+
+    def remove_session(self):
+        self.session.remove()
+
+
+class SQLiteStore:
+    """Annotations in a local SQLite file, for development and small deployments.
+
+    The file runs in WAL mode, so readers in every worker proceed while one
+    of them writes. Each thread keeps its own connection, whose statement
+    cache keeps the fixed queries below prepared; bulk inserts are one
+    ``executemany`` in one transaction. The schema is created on connect.
+    """
+
+    SELECT_EDITION = (
+        "SELECT act, scene, speaker, line_number, text FROM annotations WHERE edition = ? ORDER BY id"
+    )
+    INSERT = (
+        "INSERT INTO annotations (edition, act, scene, speaker, line_number, text) "
+        "VALUES (:edition, :act, :scene, :speaker, :line_number, :text)"
+    )
+
+    def __init__(self, path, timeout=30, on_query=None):
+        self.path = path
+        self.timeout = timeout
+        self.on_query = on_query
+        self.local = threading.local()
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SQLITE_SCHEMA)
+            self.local.connection = connection
+        return connection
+
+    def init_schema(self):
+        self.connect()
+        print(f"SQLite annotation database {self.path} is ready.")
+
+    def for_edition(self, edition_id):
+        connection = self.connect()
+        start = time.perf_counter()
+        rows = connection.execute(self.SELECT_EDITION, (edition_id,)).fetchall()
+        self._timed(self.SELECT_EDITION, start)
+        grouped = defaultdict(list)
+        for act, scene, speaker, line_number, annotation_text in rows:
+            grouped[(act, scene, speaker, line_number)].append(annotation_text)
+        return dict(grouped)
+
+    def insert_many(self, annotations):
+        connection = self.connect()
+        start = time.perf_counter()
+        with connection:
+            connection.executemany(self.INSERT, annotations)
+        self._timed(self.INSERT, start)
+
+    def _timed(self, statement, start):
+        if self.on_query:
+            self.on_query(statement, time.perf_counter() - start)
+
+    def remove_session(self):
+        # Connections stay open for the life of their thread
+        pass
+
+
+class AnnotationService:
+    """Reads and writes annotations through a storage backend.
+
+    Writes go straight to the store in their own transaction, or with
+    ``write_behind`` through an in-process queue: a background thread
+    collects annotations posted by concurrent requests and inserts up to
+    ``batch_size`` of them per transaction, waiting at most
+    ``flush_interval`` seconds for a batch to fill. ``on_commit`` is called
+    with the set of editions after every committed write.
+    """
+
+    def __init__(self, store, write_behind=False, batch_size=100, flush_interval=0.5, on_commit=None):
+        self.store = store
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+        self.queue = queue.Queue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+
+    def init_schema(self):
+        self.store.init_schema()
+
+    def for_edition(self, edition_id):
+        """Texts of an edition's annotations, grouped by (act, scene, speaker, line_number)."""
+        return self.store.for_edition(edition_id)
+
+    def add(self, annotation):
+        """Store one annotation dict; returns False if it was queued for the writer."""
+        if self.write_behind:
+            self._start_writer()
+            self.queue.put(annotation)
+            return False
+        self.add_many([annotation])
+        return True
+
+    def add_many(self, annotations):
+        """Insert a list of annotation dicts in a single transaction."""
+        if not annotations:
+            return 0
+        self.store.insert_many(annotations)
+        if self.on_commit:
+            self.on_commit({annotation['edition'] for annotation in annotations})
+        return len(annotations)
+
+    def _start_writer(self):
+        with self.writer_lock:
+            if self.writer is None:
+                atexit.register(self.flush)
+            if self.writer is None or not self.writer.is_alive():
+                # Started on first use, so forked workers each get their own thread
+                self.writer = threading.Thread(target=self._write_behind, name='annotation-writer', daemon=True)
+                self.writer.start()
+
+    def _write_behind(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        try:
+            self.add_many(batch)
+        except (SQLAlchemyError, sqlite3.Error) as e:
+            # Retry one by one so a single bad row does not lose the whole batch
+            print(f"Error writing a batch of {len(batch)} annotations, retrying individually. {e}")
+            for annotation in batch:
+                try:
+                    self.add_many([annotation])
+                except (SQLAlchemyError, sqlite3.Error) as e:
+                    print(f"Error: annotation could not be written. {e}")
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """Block until every queued annotation has been written."""
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.join()
+
+    def remove_session(self):
+        self.store.remove_session()
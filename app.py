@@ -1,178 +1,514 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, Response, stream_with_context, session, jsonify
+from flask import before_render_template, template_rendered
+import base64
+import glob
+import hashlib
 import json
 import os
-from collections import defaultdict, OrderedDict, Counter
-from sqlalchemy import create_engine, Column, Integer, String, Text, Sequence
-from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.exc import ProgrammingError, IntegrityError
-from sqlalchemy import inspect, text
-import difflib  # For textual variants visualization
-from flask import Flask
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import islice
+from markupsafe import Markup
 from whitenoise import WhiteNoise
-
-def init_db():
-    inspector = inspect(engine)
-    
-    if not inspector.has_table("annotations"):
-        with engine.connect() as connection:
-            try:
-                # Check if the sequence exists
-                connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_sequences WHERE sequencename = 'annotations_id_seq');"))
-                seq_exists = connection.fetchone()[0]
-                
-                if seq_exists:
-                    # If sequence exists, drop it
-                    connection.execute(text("DROP SEQUENCE annotations_id_seq;"))
-                
-                # Create the table (this will also create the sequence)
-                Base.metadata.create_all(bind=engine)
-                print("Database tables and sequences created.")
-            except (ProgrammingError, IntegrityError) as e:
-                print(f"An error occurred during database initialization: {e}")
-                connection.rollback()
-    else:
-        print("Tables already exist.")
+from token_index import TokenIndex, normalize_token
+from inverted_index import InvertedIndex
+from orthography import SpellingIndex, SPELLING_MODES
+from collation import collate, word_variants
+from variant_store import VariantStore, source_hashes
+from apparatus import Apparatus, ApparatusStore, cluster_lines
+from corpus import Corpus
+from edition_repository import EditionRepository
+from interaction_graph import InteractionGraphs
+from analytics import CorpusAnalytics
+from response_cache import ResponseCache, cache_key
+from annotation_service import AnnotationService, clean_annotation, open_store
+from fragment_store import FragmentStore, annotation_marker, fragment_version, splice_annotations
+from metrics import Metrics, MetricsMiddleware, SamplingProfiler, ROUTE_KEY, stats_collector
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dimHamlet!74916')  # Ensure you're using environment variables
-app.wsgi_app = WhiteNoise(app.wsgi_app, root='static/')
-
-DATABASE_URL = os.environ.get('DATABASE_URL')
-
-# Fix the database URL scheme if necessary
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-# Add client_encoding parameter
-if '?' in DATABASE_URL:
-    DATABASE_URL += "&client_encoding=utf8"
-else:
-    DATABASE_URL += "?client_encoding=utf8"
-
-# Set up the database for annotations
-engine = create_engine(DATABASE_URL)
-db_session = scoped_session(sessionmaker(bind=engine))
-
-Base = declarative_base()
+# Pre-rendered fragments have versioned paths, so browsers may keep them forever
+app.wsgi_app = WhiteNoise(app.wsgi_app, root='static/', immutable_file_test=lambda path, url: url.startswith('/fragments/'))
 
-class Annotation(Base):
-    __tablename__ = 'annotations'
-    id = Column(Integer, primary_key=True)  # PostgreSQL will use SERIAL by default
-    edition = Column(String(100))
-    act = Column(String(10))
-    scene = Column(String(10))
-    speaker = Column(String(100))
-    line_number = Column(String(10))
-    text = Column(Text)
+# Per-route latency, response size, database and template timings, served at
+# /metrics. With PROFILE_DIR set, requests sending an X-Profile header (equal
+# to PROFILE_TOKEN, if set) are sampled, and the stacks of those taking over
+# PROFILE_MIN_MS are written there as folded stacks for flame graphs.
+metrics = Metrics()
+profiler = SamplingProfiler(
+    os.environ['PROFILE_DIR'],
+    token=os.environ.get('PROFILE_TOKEN'),
+    interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000,
+    min_duration=float(os.environ.get('PROFILE_MIN_MS', 100)) / 1000
+) if os.environ.get('PROFILE_DIR') else None
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, metrics, profiler)
 
-Base.metadata.create_all(bind=engine)
-
-# Initialize the database
+# Map the columnar corpus written by process_tei.py; workers share its pages
 try:
-    init_db()
-except Exception as e:
-    print(f"An error occurred during database initialization: {e}")
+    corpus = Corpus.open('corpus.bin')
+except FileNotFoundError:
+    corpus = None
 
 try:
-    with open('texts_data.json', 'r', encoding='utf-8') as f:
-        texts_data = json.load(f)
+    if corpus is None:
+        # Fall back to the JSON export
+        with open('texts_data.json', 'r', encoding='utf-8') as f:
+            corpus = Corpus.from_entries(json.load(f))
+except FileNotFoundError as e:
+    print(f"Error: JSON file not found. {e}")
+    corpus = Corpus.from_entries([])
+except json.JSONDecodeError as e:
+    print(f"Error: Invalid JSON in data files. {e}")
+    corpus = Corpus.from_entries([])
+texts_data = corpus
+metrics.mark_startup('corpus')
 
+try:
     with open('interaction_data.json', 'r', encoding='utf-8') as f:
         interaction_data_raw = json.load(f)
 except FileNotFoundError as e:
     print(f"Error: JSON file not found. {e}")
-    texts_data = []
     interaction_data_raw = {}
 except json.JSONDecodeError as e:
     print(f"Error: Invalid JSON in data files. {e}")
-    texts_data = []
     interaction_data_raw = {}
 
-# Process the interaction data into a suitable format
-interaction_data = {}
-for edition, pairs in interaction_data_raw.items():
-    interactions = []
-    node_set = set()
-    node_degree = defaultdict(int)
-    for pair_str, count in pairs.items():
-        character1, character2 = pair_str.split('-')
-        node_set.update([character1, character2])
-        interactions.append({
-            'source': character1,
-            'target': character2,
-            'value': count  # Edge weight
-        })
-        node_degree[character1] += count
-        node_degree[character2] += count
-    nodes = [{'id': character, 'degree': node_degree[character]} for character in node_set]
-    interaction_data[edition] = {'nodes': nodes, 'links': interactions}
-
-# Organize the data by edition
-editions = {}
-for entry in texts_data:
-    edition = entry['edition']
-    if edition not in editions:
-        editions[edition] = []
-    editions[edition].append(entry)
+# Build the interaction networks of every edition and precompute their node metrics
+interaction_graphs = InteractionGraphs(interaction_data_raw)
+metrics.mark_startup('interactions')
+
+# Editions are decoded from the corpus on first access and kept in a bounded
+# LRU; limits are a number of editions and/or bytes of decoded entries
+def env_limit(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+editions = EditionRepository(
+    corpus,
+    max_editions=env_limit('EDITION_CACHE_SIZE', 4),
+    max_bytes=env_limit('EDITION_CACHE_BYTES')
+)
+
+# Organize each edition by act and scene once, for the edition and scene views.
+# The tree holds line indices; entries are decoded when a page is rendered.
+edition_acts = {}
+edition_scenes = {}
+for edition_id, data in corpus.editions.items():
+    acts = data.scene_lines()
+    edition_acts[edition_id] = acts
+    edition_scenes[edition_id] = [(act_num, scene_num) for act_num, scenes in acts.items() for scene_num in scenes]
+metrics.mark_startup('scenes')
+
+# Load the token index written by process_tei.py, or build it from the text data
+try:
+    token_index = TokenIndex.load('token_index.json')
+except FileNotFoundError:
+    token_index = TokenIndex.build(texts_data)
+except json.JSONDecodeError as e:
+    print(f"Error: Invalid JSON in token index, rebuilding it. {e}")
+    token_index = TokenIndex.build(texts_data)
+metrics.mark_startup('token_index')
+
+# Build the positional postings used by concordance, dispersion and search
+inverted_index = InvertedIndex(token_index)
+metrics.mark_startup('inverted_index')
+
+# Spelling variants and trigrams of the vocabulary for orthography-tolerant queries
+spelling_index = SpellingIndex(token_index.vocabulary)
+metrics.mark_startup('spelling_index')
+
+# Term-document statistics over editions and scenes, built once per corpus
+corpus_analytics = CorpusAnalytics(token_index, {
+    edition_id: [(act_num, scene_num, lines) for act_num, scenes in acts.items() for scene_num, lines in scenes.items()]
+    for edition_id, acts in edition_acts.items()
+})
+metrics.mark_startup('analytics')
+
+# Precomputed collations are only used while they match the TEI sources
+variant_store = VariantStore('variants.db')
+edition_hashes = source_hashes('data')
+metrics.mark_startup('source_hashes')
+
+# Corresponding lines of every edition, clustered by process_tei.py, or here
+# if that apparatus is missing or was built from other sources
+apparatus = ApparatusStore('apparatus.db').load(edition_hashes)
+if apparatus is None:
+    apparatus = Apparatus(editions.keys(), cluster_lines({edition_id: editions[edition_id] for edition_id in editions}))
+metrics.mark_startup('apparatus')
+
+# Edition and scene text pre-rendered by `flask --app app prerender`, versioned
+# by the TEI sources and the templates rendering it. Annotations are spliced
+# in per request, so serving a page never re-renders the text. Nothing in the
+# Procfile runs the command: it is a manual step for development or for hosts
+# that keep their static folder, and without it pages are rendered live.
+FRAGMENT_TEMPLATES = ['templates/_edition_text.html', 'templates/_scene.html']
+fragment_store = FragmentStore('static/fragments', fragment_version(edition_hashes, FRAGMENT_TEMPLATES))
+app.jinja_env.globals['annotation_marker'] = annotation_marker
+
+# The analytical pages are pure functions of their parameters and the corpus,
+# so their renders are cached under a version covering every input file, the
+# templates and the code rendering them; a deploy changing either starts a
+# fresh cache. Set RESPONSE_CACHE_DIR to share rendered pages between workers.
+corpus_version = hashlib.sha256(
+    json.dumps([edition_hashes, interaction_data_raw], sort_keys=True).encode('utf-8')
+).hexdigest()
+page_digest = hashlib.sha256(corpus_version.encode('utf-8'))
+for path in sorted(glob.glob('templates/**/*.html', recursive=True) + glob.glob('*.py')):
+    with open(path, 'rb') as f:
+        page_digest.update(path.encode('utf-8') + b'\0' + f.read())
+page_version = page_digest.hexdigest()
+response_cache = ResponseCache(
+    max_entries=env_limit('RESPONSE_CACHE_SIZE', 256),
+    max_bytes=env_limit('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024),
+    ttl=env_limit('RESPONSE_CACHE_TTL', 24 * 3600),
+    directory=os.environ.get('RESPONSE_CACHE_DIR'),
+    max_disk_bytes=env_limit('RESPONSE_CACHE_DISK_BYTES', 512 * 1024 * 1024)
+)
+# How long browsers and proxies may reuse a page before revalidating it
+RESPONSE_MAX_AGE = env_limit('RESPONSE_MAX_AGE', 300)
+
+metrics.collector(stats_collector('hamlet_edition_cache', "Edition cache", editions.stats))
+metrics.collector(stats_collector('hamlet_response_cache', "Response cache", response_cache.stats))
+
+def canonical_params(source, fields):
+    """Normalize form or query arguments into ordered, canonical parameters.
+
+    ``fields`` lists (name, normalize, default) triples. Values that cannot
+    be normalized fall back to the default, so equivalent requests share one
+    URL and one cache key.
+    """
+    params = OrderedDict()
+    for name, normalize, default in fields:
+        try:
+            params[name] = normalize(source.get(name, default))
+        except (TypeError, ValueError):
+            params[name] = default
+    return params
+
+def redirect_to_results(endpoint, params):
+    # Empty optional parameters are left out of the URL
+    return redirect(url_for(endpoint, **{name: value for name, value in params.items() if value != ''}), code=303)
+
+def cached_page(view, params, render):
+    """Serve a rendered page from the response cache with ETag and Cache-Control headers."""
+    if session.get('_flashes'):
+        # The page would carry this visitor's flashed messages
+        return render()
+    key = cache_key(page_version, view, params)
+    entry = response_cache.get(key)
+    if entry is None:
+        entry = response_cache.put(key, render().encode('utf-8'))
+    response = Response(entry.body, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = RESPONSE_MAX_AGE
+    return response.make_conditional(request)
+
+def text_param(value):
+    return value.strip()
+
+def lower_param(value):
+    return value.strip().lower()
+
+def words_param(value):
+    words = [word.strip() for word in value.lower().split(',')]
+    return ','.join(word for word in words if word)
+
+def positive_int(value):
+    value = int(value)
+    if value < 1:
+        raise ValueError(value)
+    return value
+
+def int_up_to(maximum):
+    """Normalizer for a positive integer no larger than ``maximum``."""
+    def normalize(value):
+        value = positive_int(value)
+        if value > maximum:
+            raise ValueError(value)
+        return value
+    return normalize
+
+def tfidf_unit(value):
+    if value not in ('edition', 'scene'):
+        raise ValueError(value)
+    return value
+
+def ngram_size(value):
+    value = int(value)
+    if value not in (2, 3):
+        raise ValueError(value)
+    return value
+
+def spelling_mode(value):
+    if value not in SPELLING_MODES:
+        raise ValueError(value)
+    return value
+
+# Cache of each edition's annotations, grouped by line. Writes through this
+# worker invalidate it once they are committed; writes from other workers
+# show up once the entry is older than ANNOTATION_CACHE_TTL seconds.
+ANNOTATION_CACHE_TTL = int(os.environ.get('ANNOTATION_CACHE_TTL', 60))
+annotation_cache = {}
+
+def invalidate_annotations(edition_ids):
+    for edition_id in edition_ids:
+        annotation_cache.pop(edition_id, None)
+
+# Annotations are stored in the database named by DATABASE_URL, through a
+# pooled engine, or without it in the local SQLite file annotations.db. The
+# schema is created by `flask --app app init-db`, not when a worker starts.
+# With ANNOTATION_WRITE_BEHIND set, single annotations are queued and
+# inserted in batches by a background thread.
+annotation_service = AnnotationService(
+    open_store(
+        os.environ.get('DATABASE_URL'),
+        on_query=metrics.observe_query,
+        pool_size=env_limit('DB_POOL_SIZE', 5),
+        max_overflow=env_limit('DB_MAX_OVERFLOW', 10),
+        pool_timeout=env_limit('DB_POOL_TIMEOUT', 30),
+        pool_recycle=env_limit('DB_POOL_RECYCLE', 1800)
+    ),
+    write_behind=bool(os.environ.get('ANNOTATION_WRITE_BEHIND')),
+    batch_size=env_limit('ANNOTATION_BATCH_SIZE', 100),
+    flush_interval=float(os.environ.get('ANNOTATION_FLUSH_INTERVAL', 0.5)),
+    on_commit=invalidate_annotations
+)
+
+# Maximum number of annotations accepted by one bulk request
+ANNOTATION_BULK_LIMIT = env_limit('ANNOTATION_BULK_LIMIT', 1000)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the annotations table and its indexes."""
+    annotation_service.init_schema()
+
+def load_annotations(edition_id):
+    cached = annotation_cache.get(edition_id)
+    if cached and time.monotonic() - cached[0] < ANNOTATION_CACHE_TTL:
+        return cached[1]
+    grouped = annotation_service.for_edition(edition_id)
+    annotation_cache[edition_id] = (time.monotonic(), grouped)
+    return grouped
+
+# Queries shared by the HTML views and the JSON API. They yield results one at
+# a time, each with the position to resume after it, so large result sets can
+# be paginated or streamed.
+
+def concordance_hits(keyword, edition=None, window_size=5, spelling='exact', after=None):
+    """(edition, stream position) and keyword-in-context window of every occurrence of a keyword or its variants."""
+    edition_ids = {edition} if edition else None
+    for posting in inverted_index.lookup_any(spelling_index.expand(keyword, spelling), edition_ids, after):
+        entry = editions.line(posting.edition, posting.line)
+        words = entry['text'].split()
+        i = posting.position
+        start = max(i - window_size, 0)
+        end = min(i + window_size + 1, len(words))
+        yield (posting.edition, inverted_index.stream_position(posting)), {
+            'edition': entry['edition'],
+            'line': posting.line,
+            'speaker': entry['speaker'],
+            'act': entry['act'],
+            'scene': entry['scene'],
+            'left': words[start:i],
+            'match': words[i],
+            'right': words[i + 1:end],
+            'keyword': keyword
+        }
 
-# Update the context processor to include Annotation
-@app.context_processor
-def inject_db_session():
-    return dict(db_session=db_session, Annotation=Annotation)
+def search_hits(query, edition=None, speaker=None, act=None, scene=None, spelling='exact', after=None):
+    """(edition, line) and entry of every line matching a search, with the filters applied."""
+    # Answer term and phrase queries from the postings, then apply the filters
+    edition_ids = {edition} if edition else None
+    expand = lambda term: spelling_index.expand(term, spelling)
+    for edition_id, line in inverted_index.search(query, edition_ids, expand, after):
+        entry = editions.line(edition_id, line)
+        if (not speaker or entry['speaker'] == speaker) and \
+           (not act or entry['act'] == act) and \
+           (not scene or entry['scene'] == scene):
+            yield (edition_id, line), entry
+
+def apparatus_readings(edition_id, line):
+    """Every edition's reading of a line, with its word variants against that line."""
+    base = editions.line(edition_id, line)
+    for witness, witness_line in apparatus.readings(edition_id, line):
+        if witness_line is None:
+            yield {'edition': witness, 'line': None, 'variants': None}
+            continue
+        entry = editions.line(witness, witness_line)
+        yield dict(
+            line_json(witness_line, entry),
+            variants=[] if witness == edition_id else word_variants(base['text'], entry['text'])
+        )
+
+def aligned_lines(edition1, edition2, after=None):
+    """Position, scene, aligned entries and word variants of every line pair of two editions, past ``after``.
+
+    Positions are (scene position, record in scene) pairs, so a page can
+    resume by reading only the stored scenes from its cursor on.
+    """
+    first_scene = 0 if after is None else after[0]
+    # Read the precomputed collation from the scene to resume in, or align the editions scene by scene
+    records = variant_store.get(edition1, edition2, edition_hashes, first_scene)
+    if records is None:
+        first_scene = 0
+        records = collate(editions.get(edition1, []), editions.get(edition2, []))
+    position, k, previous = first_scene - 1, 0, None
+    for scene, i, j, variants in records:
+        if scene != previous:
+            position, k, previous = position + 1, 0, scene
+        else:
+            k += 1
+        if after is not None and (position, k) <= tuple(after):
+            continue
+        e1 = editions.line(edition1, i) if i is not None else None
+        e2 = editions.line(edition2, j) if j is not None else None
+        yield (position, k), scene, e1, e2, variants
 
 @app.route('/')
 def index():
     return render_template('index.html', editions=editions, title="Home")
 
+# Number of template chunks Jinja collects before a streamed edition is flushed
+STREAM_BUFFER_SIZE = 200
+
+def decoded_acts(edition_id):
+    """The line entries of an edition, by act and scene."""
+    data = editions[edition_id]
+    return OrderedDict(
+        (act_num, OrderedDict((scene_num, [data[i] for i in lines]) for scene_num, lines in scenes.items()))
+        for act_num, scenes in edition_acts[edition_id].items()
+    )
+
+def render_annotations(line_annotations):
+    return render_template('_annotations.html', line_annotations=line_annotations)
+
+def prerendered(edition_id, act=None, scene=None):
+    """A pre-rendered edition or scene with its annotations spliced in, or None if it was not rendered."""
+    html = fragment_store.read(edition_id, act, scene)
+    if html is None:
+        return None
+    annotations = load_annotations(edition_id)
+    if act is not None:
+        annotations = {key: texts for key, texts in annotations.items() if key[:2] == (act, scene)}
+    return Markup(splice_annotations(html, annotations, render_annotations))
+
+@app.cli.command('prerender', short_help="Pre-render edition and scene text (manual, dev-only step).")
+def prerender_command():
+    """Pre-render the text of every edition and scene into static fragments.
+
+    Dev-only: no deploy step runs this, so deployed pages are rendered live.
+    Run it by hand on the host serving the app, after process_tei.py and
+    after every template change, for the fragments to be used.
+    """
+    with app.test_request_context():
+        for edition_id in editions:
+            acts = decoded_acts(edition_id)
+            context = dict(edition_id=edition_id, acts=acts, line_indices=edition_acts[edition_id], annotations=None)
+            fragment_store.write(render_template('_edition_text.html', **context), edition_id)
+            for act_num, scenes in acts.items():
+                for scene_num, entries in scenes.items():
+                    html = render_template('_scene.html', act_num=act_num, scene_num=scene_num, entries=entries, **context)
+                    fragment_store.write(html, edition_id, act_num, scene_num)
+    fragment_store.prune()
+    print(f"Pre-rendered {len(editions)} editions into {fragment_store.directory}.")
+
 @app.route('/edition/<edition_id>')
 def view_edition(edition_id):
-    edition_data = editions.get(edition_id)
-    if not edition_data:
+    if not edition_acts.get(edition_id):
         abort(404)
-    
-    # Organize data by act and scene
-    acts = OrderedDict()
-    for entry in edition_data:
-        act_num = entry.get('act') or 'Unknown Act'
-        scene_num = entry.get('scene') or 'Unknown Scene'
-        if act_num not in acts:
-            acts[act_num] = OrderedDict()
-        if scene_num not in acts[act_num]:
-            acts[act_num][scene_num] = []
-        acts[act_num][scene_num].append(entry)
-    
-    return render_template(
-        'edition.html',
+    text = prerendered(edition_id)
+    if text is not None:
+        # The navigation only needs the act and scene numbers
+        return render_template(
+            'edition.html',
+            edition_id=edition_id,
+            acts=edition_acts[edition_id],
+            text=text,
+            title=f"Edition {edition_id}"
+        )
+    acts = decoded_acts(edition_id)
+
+    context = dict(
         edition_id=edition_id,
         acts=acts,
+        line_indices=edition_acts[edition_id],
+        annotations=load_annotations(edition_id),
         title=f"Edition {edition_id}"
     )
+    if request.args.get('stream'):
+        # Send scenes to the browser as they are rendered
+        app.update_template_context(context)
+        stream = app.jinja_env.get_template('edition.html').stream(context)
+        stream.enable_buffering(STREAM_BUFFER_SIZE)
+        return Response(stream_with_context(stream), mimetype='text/html')
+    return render_template('edition.html', **context)
+
+@app.route('/edition/<edition_id>/act/<act>/scene/<scene>')
+def view_scene(edition_id, act, scene):
+    acts = edition_acts.get(edition_id)
+    if not acts or scene not in acts.get(act, {}):
+        abort(404)
+
+    # Link to the neighbouring scenes of the edition
+    scenes = edition_scenes[edition_id]
+    i = scenes.index((act, scene))
+    previous_scene = scenes[i - 1] if i > 0 else None
+    next_scene = scenes[i + 1] if i + 1 < len(scenes) else None
+
+    text = prerendered(edition_id, act, scene)
+    return render_template(
+        'scene.html',
+        edition_id=edition_id,
+        act_num=act,
+        scene_num=scene,
+        text=text,
+        entries=[editions.line(edition_id, i) for i in acts[act][scene]] if text is None else [],
+        line_indices=acts,
+        annotations=load_annotations(edition_id),
+        previous_scene=previous_scene,
+        next_scene=next_scene,
+        title=f"Edition {edition_id}, Act {act}, Scene {scene}"
+    )
+
+@app.route('/apparatus/<edition_id>/<int:line>')
+def view_apparatus(edition_id, line):
+    if edition_id not in editions or apparatus.cluster(edition_id, line) is None:
+        abort(404)
+    entry = editions.line(edition_id, line)
+    return render_template(
+        'apparatus.html',
+        edition_id=edition_id,
+        line=line,
+        entry=entry,
+        readings=list(apparatus_readings(edition_id, line)),
+        title=f"Line {line} of {edition_id} in every edition"
+    )
+
+COMPARE_WORD_FREQUENCIES_FIELDS = [('words', words_param, '')]
 
 @app.route('/compare_word_frequencies', methods=['GET', 'POST'])
 def compare_word_frequencies():
+    source = request.form if request.method == 'POST' else request.args
+    if 'words' not in source:
+        return render_template('compare_word_frequencies_select.html', title="Compare Word Frequencies")
+    params = canonical_params(source, COMPARE_WORD_FREQUENCIES_FIELDS)
+    if not params['words']:
+        flash('Please enter at least one word to compare.', 'warning')
+        return redirect(url_for('compare_word_frequencies'))
     if request.method == 'POST':
-        words = request.form.get('words', '').lower().split(',')
-        words = [word.strip() for word in words if word.strip()]
-        if not words:
-            flash('Please enter at least one word to compare.', 'warning')
-            return redirect(url_for('compare_word_frequencies'))
-        
-        # Prepare data
-        edition_word_counts = {}
-        for edition_id, data in editions.items():
-            full_text = ' '.join(entry['text'] for entry in data)
-            word_list = [word.lower() for word in full_text.split()]
-            word_counts = Counter(word_list)
-            edition_word_counts[edition_id] = word_counts
-        
-        # Organize data for visualization
+        return redirect_to_results('compare_word_frequencies', params)
+    words = params['words'].split(',')
+
+    def render():
+        # Organize data for visualization using the precomputed term counts
         labels = list(editions.keys())
         datasets = []
         for word in words:
-            data = [edition_word_counts[edition_id].get(word, 0) for edition_id in labels]
+            data = [token_index.count(edition_id, word) for edition_id in labels]
             datasets.append({'label': word, 'data': data})
-        
+
         return render_template(
             'compare_word_frequencies.html',
             labels=labels,
@@ -180,58 +516,34 @@ def compare_word_frequencies():
             words=words,
             title="Compare Word Frequencies Across Editions"
         )
-    else:
-        return render_template('compare_word_frequencies_select.html', title="Compare Word Frequencies")
+    return cached_page('compare_word_frequencies', params, render)
+
+COMPARE_FIELDS = [('edition1', text_param, ''), ('edition2', text_param, '')]
 
 # Updated compare_editions route with textual variants visualization
 @app.route('/compare', methods=['GET', 'POST'])
 def compare_editions():
     if request.method == 'POST':
-        edition1 = request.form.get('edition1')
-        edition2 = request.form.get('edition2')
-        data1 = editions.get(edition1, [])
-        data2 = editions.get(edition2, [])
-        
-        # Organize data by act, scene, speaker, and line number for alignment
-        def organize_data(data):
-            organized = {}
-            for entry in data:
-                key = (entry.get('act'), entry.get('scene'), entry.get('speaker'), entry.get('line_number'))
-                organized[key] = entry
-            return organized
-        
-        data1_organized = organize_data(data1)
-        data2_organized = organize_data(data2)
-        
-        # Get all keys for alignment
-        all_keys = sorted(set(data1_organized.keys()) | set(data2_organized.keys()))
-        
-        aligned_data = []
-        for key in all_keys:
-            e1 = data1_organized.get(key)
-            e2 = data2_organized.get(key)
-            diff = None
-            if e1 and e2:
-                diff = difflib.HtmlDiff().make_table(
-                    [e1['text']], [e2['text']],
-                    fromdesc=edition1, todesc=edition2,
-                    context=True, numlines=0
-                )
-            aligned_data.append((e1, e2, diff))
-        
-        return render_template('compare.html', edition1=edition1, edition2=edition2, aligned_data=aligned_data, title="Compare Editions")
-    else:
+        return redirect_to_results('compare_editions', canonical_params(request.form, COMPARE_FIELDS))
+    if 'edition1' not in request.args:
         return render_template('compare_select.html', editions=editions, title="Compare Editions")
+    params = canonical_params(request.args, COMPARE_FIELDS)
+    edition1, edition2 = params['edition1'], params['edition2']
+
+    def render():
+        aligned_data = [(e1, e2, variants) for _, scene, e1, e2, variants in aligned_lines(edition1, edition2)]
+        return render_template('compare.html', edition1=edition1, edition2=edition2, aligned_data=aligned_data, title="Compare Editions")
+    return cached_page('compare_editions', params, render)
 
 @app.route('/interactions')
 def interactions():
     # List all available editions
-    edition_list = list(interaction_data.keys())
+    edition_list = list(interaction_graphs.editions)
     return render_template('interactions_select.html', editions=edition_list, title="Character Interactions")
 
 @app.route('/interactions/<edition_id>')
 def view_interactions(edition_id):
-    data = interaction_data.get(edition_id)
+    data = interaction_graphs.get(edition_id)
     if not data:
         abort(404)
     return render_template('interactions.html', edition_id=edition_id, data=data, title=f"Interactions in {edition_id}")
@@ -239,48 +551,19 @@ def view_interactions(edition_id):
 @app.route('/compare_interactions', methods=['GET', 'POST'])
 def compare_interactions():
     if request.method == 'POST':
-        edition1 = request.form.get('edition1')
-        edition2 = request.form.get('edition2')
-        data1 = interaction_data.get(edition1)
-        data2 = interaction_data.get(edition2)
-        if not data1 or not data2:
-            abort(404)
-        
-        # Prepare merged data for visualization
-        # Merge nodes
-        nodes_dict = {}
-        for node in data1['nodes']:
-            nodes_dict[node['id']] = {'id': node['id']}
-        for node in data2['nodes']:
-            nodes_dict[node['id']] = {'id': node['id']}
-        nodes = list(nodes_dict.values())
-        
-        # Merge links
-        link_map = {}
-        for link in data1['links']:
-            key = (link['source'], link['target'])
-            link_map[key] = {
-                'source': link['source'],
-                'target': link['target'],
-                'value1': link['value'],
-                'value2': 0,
-                'editions': [edition1]
-            }
-        for link in data2['links']:
-            key = (link['source'], link['target'])
-            if key in link_map:
-                link_map[key]['value2'] = link['value']
-                link_map[key]['editions'].append(edition2)
-            else:
-                link_map[key] = {
-                    'source': link['source'],
-                    'target': link['target'],
-                    'value1': 0,
-                    'value2': link['value'],
-                    'editions': [edition2]
-                }
-        links = list(link_map.values())
-        
+        return redirect_to_results('compare_interactions', canonical_params(request.form, COMPARE_FIELDS))
+    if 'edition1' not in request.args:
+        edition_list = list(interaction_graphs.editions)
+        return render_template('compare_interactions_select.html', editions=edition_list, title="Compare Character Interactions")
+    params = canonical_params(request.args, COMPARE_FIELDS)
+    edition1, edition2 = params['edition1'], params['edition2']
+    if edition1 not in interaction_graphs or edition2 not in interaction_graphs:
+        abort(404)
+
+    def render():
+        # Merge nodes and links of both editions for visualization
+        nodes, links = interaction_graphs.diff(edition1, edition2)
+
         return render_template(
             'compare_interactions.html',
             edition1=edition1,
@@ -289,28 +572,27 @@ def compare_interactions():
             links=links,
             title=f"Compare Character Interactions: {edition1} vs {edition2}"
         )
-    else:
-        edition_list = list(interaction_data.keys())
-        return render_template('compare_interactions_select.html', editions=edition_list, title="Compare Character Interactions")
+    return cached_page('compare_interactions', params, render)
+
+WORD_FREQUENCY_FIELDS = [('edition', text_param, ''), ('num_words', positive_int, 20)]
 
 # New route for Word Frequency Analysis
 @app.route('/word_frequency', methods=['GET', 'POST'])
 def word_frequency():
     if request.method == 'POST':
-        edition = request.form.get('edition')
-        num_words = int(request.form.get('num_words', 20))
-        # Get text data for the selected edition
-        data = editions.get(edition)
-        if not data:
-            abort(404)
-        # Concatenate all text entries
-        full_text = ' '.join(entry['text'] for entry in data)
-        # Tokenize and count words
-        words = [word.lower() for word in full_text.split()]
-        word_counts = Counter(words)
-        most_common = word_counts.most_common(num_words)
+        return redirect_to_results('word_frequency', canonical_params(request.form, WORD_FREQUENCY_FIELDS))
+    if 'edition' not in request.args:
+        return render_template('word_frequency_select.html', editions=editions.keys(), title="Word Frequency Analysis")
+    params = canonical_params(request.args, WORD_FREQUENCY_FIELDS)
+    edition, num_words = params['edition'], params['num_words']
+    if edition not in editions:
+        abort(404)
+
+    def render():
+        # Look up the most common words in the precomputed term counts
+        most_common = token_index.most_common(edition, num_words)
         # Prepare data for visualization
-        labels, values = zip(*most_common)
+        labels, values = zip(*most_common) if most_common else ((), ())
         return render_template(
             'word_frequency.html',
             edition=edition,
@@ -319,66 +601,59 @@ def word_frequency():
             num_words=num_words,
             title=f"Word Frequency in {edition}"
         )
-    else:
-        return render_template('word_frequency_select.html', editions=editions.keys(), title="Word Frequency Analysis")
+    return cached_page('word_frequency', params, render)
+
+CONCORDANCE_FIELDS = [
+    ('keyword', lower_param, ''),
+    ('edition', text_param, ''),
+    ('window_size', positive_int, 5),
+    ('spelling', spelling_mode, 'exact'),
+]
 
 # New route for Concordance (Keyword in Context)
 @app.route('/concordance', methods=['GET', 'POST'])
 def concordance():
     if request.method == 'POST':
-        keyword = request.form.get('keyword', '').lower()
-        edition = request.form.get('edition')
-        window_size = int(request.form.get('window_size', 5))
+        return redirect_to_results('concordance', canonical_params(request.form, CONCORDANCE_FIELDS))
+    if 'keyword' not in request.args:
+        return render_template('concordance_form.html', editions=editions.keys(), title="Concordance Search")
+    params = canonical_params(request.args, CONCORDANCE_FIELDS)
+    keyword, edition, window_size, spelling = params.values()
+
+    def render():
         results = []
-        data = editions.get(edition) if edition else texts_data
-        for entry in data:
-            text = entry['text']
-            words = text.split()
-            for i, word in enumerate(words):
-                if keyword == word.lower():
-                    start = max(i - window_size, 0)
-                    end = min(i + window_size + 1, len(words))
-                    context_words = words[start:end]
-                    # Highlight the keyword
-                    context_words[i - start] = f"<strong>{context_words[i - start]}</strong>"
-                    context = ' '.join(context_words)
-                    results.append({
-                        'edition': entry['edition'],
-                        'speaker': entry['speaker'],
-                        'act': entry['act'],
-                        'scene': entry['scene'],
-                        'context': context,
-                        'keyword': keyword
-                    })
+        for _, hit in concordance_hits(keyword, edition, window_size, spelling):
+            # Highlight the keyword
+            context = ' '.join(hit['left'] + [f"<strong>{hit['match']}</strong>"] + hit['right'])
+            results.append(dict(hit, context=context))
         return render_template(
             'concordance.html',
             keyword=keyword,
             results=results,
+            spellings=spelling_index.expand(keyword, spelling) if spelling != 'exact' else [],
             editions=editions.keys(),
             title=f"Concordance for '{keyword}'"
         )
-    else:
-        return render_template('concordance_form.html', editions=editions.keys(), title="Concordance Search")
+    return cached_page('concordance', params, render)
+
+DISPERSION_FIELDS = [('keyword', lower_param, ''), ('edition', text_param, '')]
 
 # New route for Lexical Dispersion Plot
 @app.route('/dispersion', methods=['GET', 'POST'])
 def dispersion():
     if request.method == 'POST':
-        keyword = request.form.get('keyword', '').lower()
-        edition = request.form.get('edition')
-        data = editions.get(edition)
-        if not data:
-            abort(404)
-        # Prepare data for dispersion plot
-        word_positions = []
-        total_words = 0
-        for entry in data:
-            text = entry['text']
-            words = text.split()
-            for word in words:
-                if word.lower() == keyword:
-                    word_positions.append(total_words)
-                total_words += 1
+        return redirect_to_results('dispersion', canonical_params(request.form, DISPERSION_FIELDS))
+    if 'keyword' not in request.args:
+        return render_template('dispersion_form.html', editions=editions.keys(), title="Lexical Dispersion Plot")
+    params = canonical_params(request.args, DISPERSION_FIELDS)
+    keyword, edition = params['keyword'], params['edition']
+    if edition not in editions:
+        abort(404)
+
+    def render():
+        # Prepare data for dispersion plot from the keyword's postings
+        word_positions = inverted_index.positions(edition, normalize_token(keyword))
+        total_words = token_index.total_tokens(edition)
         return render_template(
             'dispersion.html',
             keyword=keyword,
@@ -387,60 +662,469 @@ def dispersion():
             edition=edition,
             title=f"Lexical Dispersion of '{keyword}' in {edition}"
         )
-    else:
-        return render_template('dispersion_form.html', editions=editions.keys(), title="Lexical Dispersion Plot")
+    return cached_page('dispersion', params, render)
+
+SEARCH_FIELDS = [
+    ('query', lower_param, ''),
+    ('edition', text_param, ''),
+    ('speaker', text_param, ''),
+    ('act', text_param, ''),
+    ('scene', text_param, ''),
+    ('spelling', spelling_mode, 'exact'),
+]
 
 @app.route('/search', methods=['GET', 'POST'])
 def search():
     if request.method == 'POST':
-        query = request.form.get('query', '').lower()
-        edition = request.form.get('edition')
-        speaker = request.form.get('speaker')
-        act = request.form.get('act')
-        scene = request.form.get('scene')
-        results = []
-        for entry in texts_data:
-            if query in entry['text'].lower():
-                if (not edition or entry['edition'] == edition) and \
-                   (not speaker or entry['speaker'] == speaker) and \
-                   (not act or entry['act'] == act) and \
-                   (not scene or entry['scene'] == scene):
-                    results.append(entry)
-        return render_template('search.html', query=query, results=results, editions=editions.keys(), title=f"Search Results for '{query}'")
-    else:
+        return redirect_to_results('search', canonical_params(request.form, SEARCH_FIELDS))
+    if 'query' not in request.args:
         return render_template('search_form.html', editions=editions.keys(), title="Advanced Search")
+    params = canonical_params(request.args, SEARCH_FIELDS)
+    query, edition, speaker, act, scene, spelling = params.values()
+
+    def render():
+        results = [entry for _, entry in search_hits(query, edition, speaker, act, scene, spelling)]
+        return render_template('search.html', query=query, results=results, editions=editions.keys(), title=f"Search Results for '{query}'")
+    return cached_page('search', params, render)
+
+@app.route('/analytics')
+def analytics():
+    return render_template('analytics.html', editions=editions.keys(), title="Corpus Statistics")
+
+KEYNESS_FIELDS = [('edition', text_param, ''), ('reference', text_param, ''), ('k', positive_int, 30)]
+
+@app.route('/keyness')
+def keyness():
+    params = canonical_params(request.args, KEYNESS_FIELDS)
+    edition, reference, k = params.values()
+    if edition not in corpus_analytics or reference and reference not in corpus_analytics:
+        abort(404)
+
+    def render():
+        return render_template(
+            'keyness.html',
+            edition=edition,
+            reference=reference,
+            results=corpus_analytics.keyness(edition, reference, k),
+            title=f"Keyness of {edition}"
+        )
+    return cached_page('keyness', params, render)
+
+TFIDF_FIELDS = [('edition', text_param, ''), ('unit', tfidf_unit, 'edition'), ('k', positive_int, 20)]
+
+@app.route('/tfidf')
+def tfidf():
+    params = canonical_params(request.args, TFIDF_FIELDS)
+    edition, unit, k = params.values()
+    if edition not in corpus_analytics:
+        abort(404)
+
+    def render():
+        return render_template(
+            'tfidf.html',
+            edition=edition,
+            unit=unit,
+            results=corpus_analytics.tfidf(edition, unit, k),
+            title=f"TF-IDF of {edition}"
+        )
+    return cached_page('tfidf', params, render)
+
+# Collocation windows cost memory in proportion to occurrences times window
+MAX_COLLOCATION_WINDOW = 50
+MAX_COLLOCATIONS = 500
+
+COLLOCATION_FIELDS = [
+    ('keyword', lower_param, ''),
+    ('edition', text_param, ''),
+    ('window', int_up_to(MAX_COLLOCATION_WINDOW), 5),
+    ('k', int_up_to(MAX_COLLOCATIONS), 30),
+]
+
+@app.route('/collocations')
+def collocations():
+    params = canonical_params(request.args, COLLOCATION_FIELDS)
+    keyword, edition, window, k = params.values()
+    if not keyword:
+        return redirect(url_for('analytics'))
+    if edition and edition not in corpus_analytics:
+        abort(404)
+
+    def render():
+        return render_template(
+            'collocations.html',
+            keyword=keyword,
+            edition=edition,
+            window=window,
+            results=corpus_analytics.collocations(keyword, edition, window, k),
+            title=f"Collocations of '{keyword}'"
+        )
+    return cached_page('collocations', params, render)
+
+NGRAM_FIELDS = [('edition', text_param, ''), ('n', ngram_size, 2), ('k', positive_int, 30)]
+
+@app.route('/ngrams')
+def ngrams():
+    params = canonical_params(request.args, NGRAM_FIELDS)
+    edition, n, k = params.values()
+    if edition not in corpus_analytics:
+        abort(404)
+
+    def render():
+        return render_template(
+            'ngrams.html',
+            edition=edition,
+            n=n,
+            results=corpus_analytics.ngrams(edition, n, k),
+            title=f"N-grams in {edition}"
+        )
+    return cached_page('ngrams', params, render)
+
+# JSON API. List endpoints return pages of at most `limit` results with a
+# cursor for the next page, or every result as NDJSON with ?format=ndjson.
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+def api_error(status, message):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+def encode_cursor(after):
+    # Cursors are tied to the corpus version, so they expire when it is rebuilt
+    payload = json.dumps({'v': corpus_version[:16], 'a': after}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, resume):
+    payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if payload['v'] != corpus_version[:16]:
+        raise ValueError(cursor)
+    return resume(payload['a'])
+
+# Resume positions of API results, as read back from a cursor
+
+def resume_index(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
+
+def resume_edition_position(value):
+    edition_id, position = value
+    if edition_id not in editions:
+        raise ValueError(edition_id)
+    return edition_id, resume_index(position)
+
+def resume_scene_record(value):
+    scene_position, record = value
+    return resume_index(scene_position), resume_index(record)
+
+def listed(items):
+    """Results of an in-memory list, resumed by index."""
+    def results(after):
+        start = 0 if after is None else after + 1
+        return ((i, items[i]) for i in range(start, len(items)))
+    return results
+
+def api_results(results, resume=resume_index):
+    """Respond with one page of results, or stream all of them as NDJSON.
+
+    ``results(after)`` yields (position, result) pairs in order, starting
+    past the position ``after`` (None for the first page). The cursor of
+    the next page holds the position of the last result on this one, so
+    every page resumes where the previous one stopped instead of skipping
+    over it; ``resume`` validates a position read back from a cursor.
+    """
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for _, result in results(None):
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'], resume)
+        except (ValueError, KeyError, TypeError):
+            return api_error(400, "Invalid or expired cursor.")
+    # Read one result past the page to know whether there is a next one
+    page = list(islice(results(after), limit + 1))
+    next_cursor = encode_cursor(page[limit - 1][0]) if len(page) > limit else None
+    return jsonify(results=[result for _, result in page[:limit]], next_cursor=next_cursor)
+
+def line_json(line, entry):
+    return {
+        'edition': entry['edition'],
+        'line': line,
+        'act': entry['act'],
+        'scene': entry['scene'],
+        'speaker': entry['speaker'],
+        'line_number': entry['line_number'],
+        'text': entry['text']
+    }
+
+@app.route('/api/v1/editions')
+def api_editions():
+    return jsonify(editions=[
+        {
+            'id': edition_id,
+            'title': metadata['title'],
+            'author': metadata['author'],
+            'date': metadata['date'],
+            'lines': metadata['end'] - metadata['start'],
+            'scenes': [{'act': act, 'scene': scene} for act, scene in edition_scenes[edition_id]]
+        }
+        for edition_id, metadata in corpus.edition_metadata.items()
+    ])
+
+@app.route('/api/v1/editions/<edition_id>/lines')
+def api_lines(edition_id):
+    acts = edition_acts.get(edition_id)
+    if acts is None:
+        return api_error(404, f"Unknown edition {edition_id}.")
+    act = request.args.get('act')
+    scene = request.args.get('scene')
+    if act and act not in acts or scene and scene not in acts.get(act, {}):
+        return api_error(404, "Unknown act or scene.")
+
+    def results(after):
+        start = 0 if after is None else after + 1
+        if scene:
+            lines = acts[act][scene][bisect_left(acts[act][scene], start):]
+        elif act:
+            lines = (i for scene_lines in acts[act].values() for i in scene_lines[bisect_left(scene_lines, start):])
+        else:
+            lines = range(start, len(corpus.editions[edition_id]))
+        return ((i, line_json(i, editions.line(edition_id, i))) for i in lines)
+    return api_results(results)
+
+@app.route('/api/v1/editions/<edition_id>/annotations')
+def api_edition_annotations(edition_id):
+    acts = edition_acts.get(edition_id)
+    if acts is None:
+        return api_error(404, f"Unknown edition {edition_id}.")
+    act = request.args.get('act')
+    scene = request.args.get('scene')
+    if act and act not in acts or scene and scene not in acts.get(act, {}):
+        return api_error(404, "Unknown act or scene.")
+    # The annotations of a pre-rendered fragment, to be inserted at their markers client-side
+    fragment_path = fragment_store.path(edition_id, act if scene else None, scene or None)
+    return jsonify(
+        fragment=fragment_store.url(edition_id, act if scene else None, scene or None) if os.path.exists(fragment_path) else None,
+        annotations=[
+            {
+                'act': key[0],
+                'scene': key[1],
+                'speaker': key[2],
+                'line_number': key[3],
+                'marker': str(annotation_marker(*key)),
+                'texts': texts
+            }
+            for key, texts in load_annotations(edition_id).items()
+            if (not act or key[0] == act) and (not scene or key[1] == scene)
+        ]
+    )
+
+@app.route('/api/v1/concordance')
+def api_concordance():
+    params = canonical_params(request.args, CONCORDANCE_FIELDS)
+    if not params['keyword']:
+        return api_error(400, "Missing keyword.")
+    if params['edition'] and params['edition'] not in editions:
+        return api_error(404, f"Unknown edition {params['edition']}.")
+    return api_results(lambda after: concordance_hits(*params.values(), after=after), resume_edition_position)
+
+@app.route('/api/v1/search')
+def api_search():
+    params = canonical_params(request.args, SEARCH_FIELDS)
+    if not params['query']:
+        return api_error(400, "Missing query.")
+    return api_results(
+        lambda after: ((key, line_json(key[1], entry)) for key, entry in search_hits(*params.values(), after=after)),
+        resume_edition_position
+    )
+
+@app.route('/api/v1/dispersion')
+def api_dispersion():
+    params = canonical_params(request.args, DISPERSION_FIELDS)
+    keyword, edition = params['keyword'], params['edition']
+    if edition not in editions:
+        return api_error(404, f"Unknown edition {edition}.")
+    return jsonify(
+        keyword=keyword,
+        edition=edition,
+        positions=inverted_index.positions(edition, normalize_token(keyword)),
+        total_words=token_index.total_tokens(edition)
+    )
+
+@app.route('/api/v1/frequencies')
+def api_frequencies():
+    # Counts of given words in every edition, or the most common words of one edition
+    words = words_param(request.args.get('words', ''))
+    if words:
+        return jsonify(frequencies={
+            word: {edition_id: token_index.count(edition_id, word) for edition_id in editions}
+            for word in words.split(',')
+        })
+    params = canonical_params(request.args, WORD_FREQUENCY_FIELDS)
+    if params['edition'] not in editions:
+        return api_error(404, f"Unknown edition {params['edition']}.")
+    return api_results(listed([
+        {'word': word, 'count': count}
+        for word, count in token_index.most_common(params['edition'], params['num_words'])
+    ]))
+
+@app.route('/api/v1/variants')
+def api_variants():
+    params = canonical_params(request.args, COMPARE_FIELDS)
+    edition1, edition2 = params['edition1'], params['edition2']
+    for edition in (edition1, edition2):
+        if edition not in editions:
+            return api_error(404, f"Unknown edition {edition}.")
+
+    def records(after):
+        for position, (act, scene), e1, e2, variants in aligned_lines(edition1, edition2, after):
+            yield position, {
+                'act': act,
+                'scene': scene,
+                'text1': e1['text'] if e1 else None,
+                'text2': e2['text'] if e2 else None,
+                'speaker1': e1['speaker'] if e1 else None,
+                'speaker2': e2['speaker'] if e2 else None,
+                'variants': variants
+            }
+    return api_results(records, resume_scene_record)
+
+@app.route('/api/v1/apparatus/<edition_id>/<int:line>')
+def api_apparatus(edition_id, line):
+    if edition_id not in editions or apparatus.cluster(edition_id, line) is None:
+        return api_error(404, f"Unknown line {line} of edition {edition_id}.")
+    return jsonify(
+        edition=edition_id,
+        line=line,
+        cluster=apparatus.cluster(edition_id, line),
+        readings=list(apparatus_readings(edition_id, line))
+    )
+
+@app.route('/api/v1/interactions/<edition_id>')
+def api_interactions(edition_id):
+    data = interaction_graphs.get(edition_id)
+    if not data:
+        return api_error(404, f"Unknown edition {edition_id}.")
+    return jsonify(edition=edition_id, **data)
+
+@app.route('/api/v1/interactions')
+def api_compare_interactions():
+    params = canonical_params(request.args, COMPARE_FIELDS)
+    edition1, edition2 = params['edition1'], params['edition2']
+    if edition1 not in interaction_graphs or edition2 not in interaction_graphs:
+        return api_error(404, "Unknown edition.")
+    nodes, links = interaction_graphs.diff(edition1, edition2)
+    return jsonify(edition1=edition1, edition2=edition2, nodes=nodes, links=links)
+
+@app.route('/api/v1/keyness')
+def api_keyness():
+    params = canonical_params(request.args, KEYNESS_FIELDS)
+    edition, reference, k = params.values()
+    for edition_id in filter(None, (edition, reference)):
+        if edition_id not in corpus_analytics:
+            return api_error(404, f"Unknown edition {edition_id}.")
+    if not edition:
+        return api_error(404, "Unknown edition.")
+    return jsonify(edition=edition, reference=reference or None, **corpus_analytics.keyness(edition, reference, k))
+
+@app.route('/api/v1/tfidf')
+def api_tfidf():
+    params = canonical_params(request.args, TFIDF_FIELDS)
+    edition, unit, k = params.values()
+    if edition not in corpus_analytics:
+        return api_error(404, f"Unknown edition {edition}.")
+    return api_results(listed(corpus_analytics.tfidf(edition, unit, k)))
+
+@app.route('/api/v1/collocations')
+def api_collocations():
+    params = canonical_params(request.args, COLLOCATION_FIELDS)
+    keyword, edition, window, k = params.values()
+    if not keyword:
+        return api_error(400, "Missing keyword.")
+    if edition and edition not in corpus_analytics:
+        return api_error(404, f"Unknown edition {edition}.")
+    return jsonify(keyword=keyword, edition=edition or None, window=window,
+                   **corpus_analytics.collocations(keyword, edition, window, k))
+
+@app.route('/api/v1/ngrams')
+def api_ngrams():
+    params = canonical_params(request.args, NGRAM_FIELDS)
+    edition, n, k = params.values()
+    if edition not in corpus_analytics:
+        return api_error(404, f"Unknown edition {edition}.")
+    return api_results(listed(corpus_analytics.ngrams(edition, n, k)))
+
+@app.route('/api/v1/annotations', methods=['POST'])
+def api_add_annotations():
+    # Accept a list of annotations, or an object holding one under "annotations"
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('annotations')
+    if not isinstance(data, list) or not data:
+        return api_error(400, "Expected a non-empty list of annotations.")
+    if len(data) > ANNOTATION_BULK_LIMIT:
+        return api_error(413, f"At most {ANNOTATION_BULK_LIMIT} annotations per request.")
+    annotations = []
+    for i, item in enumerate(data):
+        try:
+            annotation = clean_annotation(item)
+        except ValueError as e:
+            return api_error(400, f"Annotation {i}: {e}")
+        if annotation['edition'] not in editions:
+            return api_error(400, f"Annotation {i}: unknown edition {annotation['edition']}.")
+        annotations.append(annotation)
+    # All annotations of the request are inserted in one transaction
+    created = annotation_service.add_many(annotations)
+    response = jsonify(created=created)
+    response.status_code = 201
+    return response
 
 @app.route('/annotate', methods=['POST'])
 def annotate():
     edition = request.form.get('edition')
-    act = request.form.get('act')
-    scene = request.form.get('scene')
-    speaker = request.form.get('speaker')
-    line_number = request.form.get('line_number')
-    annotation_text = request.form.get('annotation_text')
-    if annotation_text:
-        annotation = Annotation(
-            edition=edition,
-            act=act,
-            scene=scene,
-            speaker=speaker,
-            line_number=line_number,
-            text=annotation_text
-        )
-        db_session.add(annotation)
-        db_session.commit()
-        flash('Annotation added successfully.')
+    try:
+        annotation = clean_annotation(dict(request.form.to_dict(), text=request.form.get('annotation_text')))
+    except ValueError as e:
+        flash(str(e))
     else:
-        flash('Annotation text cannot be empty.')
+        if annotation_service.add(annotation):
+            flash('Annotation added successfully.')
+        else:
+            flash('Annotation added; it will appear shortly.')
     return redirect(url_for('view_edition', edition_id=edition))
 
+@app.before_request
+def record_route():
+    # Label the request's metrics with the rule it matched
+    request.environ[ROUTE_KEY] = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    metrics.start_template()
+
+@template_rendered.connect_via(app)
+def end_template_timer(sender, template, context, **extra):
+    metrics.end_template(template.name)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.errorhandler(404)
 def page_not_found(e):
+    if request.path.startswith('/api/'):
+        return api_error(404, "Not found.")
     return render_template('404.html', title="Page Not Found"), 404
 
 @app.teardown_appcontext
 def shutdown_session(exception=None):
-    db_session.remove()
+    annotation_service.remove_session()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,271 @@
+import json
+import os
+import sqlite3
+from array import array
+from collections import defaultdict
+from contextlib import closing
+from itertools import combinations
+
+import numpy as np
+
+from collation import MIN_LINE_SIMILARITY, heaviest_chain
+from orthography import fold_final_e, normalize_spelling
+from token_index import tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    edition TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS witnesses (
+    edition TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    cluster INTEGER NOT NULL,
+    PRIMARY KEY (edition, line)
+);
+"""
+
+# Version of the stored apparatus. Bump it whenever the shingling, the
+# MinHash/LSH parameters or the clustering change, so an apparatus built by
+# the old code is rebuilt instead of loaded.
+APPARATUS_VERSION = 1
+
+# MinHash signature length, split into bands of BAND_ROWS values for LSH.
+# Two lines with Jaccard similarity s share a band with probability
+# 1 - (1 - s^2)^24: about 0.9 at MIN_LINE_SIMILARITY and 0.999 at 0.5.
+NUM_PERMUTATIONS = 48
+BAND_ROWS = 2
+
+# Modulus of the universal hash functions standing in for permutations
+HASH_PRIME = (1 << 31) - 1
+
+# LSH buckets with more forms than this only gather lines sharing common
+# words; similar pairs in them almost always meet again in a smaller bucket
+MAX_BUCKET_SIZE = 50
+
+# A form found in more clusters than this ("My lord.") only joins clusters
+# holding the identical form, not those of every similar one
+MAX_FORM_CLUSTERS = 10
+
+
+def shingles(text):
+    """Spelling-normalized words of a line, so "haue" and "have" or "deare" and "dear" are one shingle."""
+    return frozenset(fold_final_e(normalize_spelling(term)) for term in tokenize(text) if term)
+
+
+def minhash_signatures(forms, num_permutations=NUM_PERMUTATIONS, seed=0):
+    """MinHash signatures of non-empty shingle sets, one row per set."""
+    shingle_ids = {}
+    ids, owners = [], []
+    for k, form in enumerate(forms):
+        # Sorted, so shingle ids and signatures do not depend on string hashing
+        for shingle in sorted(form):
+            ids.append(shingle_ids.setdefault(shingle, len(shingle_ids)))
+            owners.append(k)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, HASH_PRIME, num_permutations)
+    b = rng.integers(0, HASH_PRIME, num_permutations)
+    hashes = (np.asarray(ids, dtype=np.int64)[:, None] * a + b) % HASH_PRIME
+    starts = np.flatnonzero(np.diff(np.asarray(owners), prepend=-1))
+    return np.minimum.reduceat(hashes, starts, axis=0)
+
+
+def lsh_candidates(signatures, rows=BAND_ROWS, max_bucket_size=MAX_BUCKET_SIZE):
+    """Pairs (k, l), k < l, of signatures that agree on every row of some band."""
+    candidates = set()
+    for start in range(0, signatures.shape[1], rows):
+        # Fold the rows of a band into one bucket key; an overflow only merges buckets
+        buckets = np.zeros(len(signatures), dtype=np.int64)
+        for row in range(start, min(start + rows, signatures.shape[1])):
+            buckets = buckets * HASH_PRIME + signatures[:, row]
+        order = np.argsort(buckets, kind='stable')
+        for members in np.split(order, np.flatnonzero(np.diff(buckets[order])) + 1):
+            if 1 < len(members) <= max_bucket_size:
+                candidates.update(combinations(members.tolist(), 2))
+    return candidates
+
+
+def cluster_lines(editions):
+    """Group corresponding lines of every edition into clusters, in reading order.
+
+    ``editions`` maps edition ids, in corpus order, to their lists of line
+    entries. Identical lines share one shingle set ("form"); similar forms
+    are found with MinHash/LSH and kept if their Jaccard similarity reaches
+    MIN_LINE_SIMILARITY. Editions are then aligned one after the other
+    against the clusters built so far: the heaviest in-order chain of
+    (line, cluster) pairs between similar forms joins lines to existing
+    clusters, and every other line starts a new cluster. Each cluster holds
+    at most one line per edition. Returns a list of {edition: line} dicts.
+    """
+    form_ids = {}
+    line_forms = {}
+    for edition_id, entries in editions.items():
+        line_forms[edition_id] = [
+            form_ids.setdefault(form, len(form_ids)) if form else None
+            for form in map(shingles, (entry['text'] for entry in entries))
+        ]
+    forms = list(form_ids)
+
+    similar = [{f: 1.0} for f in range(len(forms))]
+    if forms:
+        for f, g in lsh_candidates(minhash_signatures(forms)):
+            similarity = len(forms[f] & forms[g]) / len(forms[f] | forms[g])
+            if similarity >= MIN_LINE_SIMILARITY:
+                similar[f][g] = similar[g][f] = similarity
+
+    order = []
+    clusters = []
+    form_clusters = defaultdict(list)
+    for edition_id, line_form in line_forms.items():
+        rank = {cluster: r for r, cluster in enumerate(order)}
+        pairs = []
+        for i, f in enumerate(line_form):
+            if f is None:
+                continue
+            weights = {}
+            for g, similarity in similar[f].items():
+                if g != f and len(form_clusters.get(g, ())) > MAX_FORM_CLUSTERS:
+                    continue
+                for cluster in form_clusters.get(g, ()):
+                    if similarity > weights.get(cluster, 0.0):
+                        weights[cluster] = similarity
+            pairs.extend(sorted((i, rank[cluster], similarity) for cluster, similarity in weights.items()))
+        matched = dict(heaviest_chain(pairs, len(order)))
+
+        # Insert the new clusters of unmatched lines after the cluster of the line before them
+        new_order = []
+        r = 0
+        for i, f in enumerate(line_form):
+            if i in matched:
+                new_order.extend(order[r:matched[i] + 1])
+                r = matched[i] + 1
+                cluster = order[matched[i]]
+            else:
+                cluster = len(clusters)
+                clusters.append({})
+                new_order.append(cluster)
+            clusters[cluster][edition_id] = i
+            if f is not None and (not form_clusters[f] or form_clusters[f][-1] != cluster):
+                form_clusters[f].append(cluster)
+        order = new_order + order[r:]
+    return [clusters[cluster] for cluster in order]
+
+
+class Apparatus:
+    """Every edition's reading of a line, looked up in constant time.
+
+    Holds the line clusters of ``cluster_lines`` as a flat list of
+    witnesses per cluster, and per edition an array mapping each line to
+    its cluster.
+    """
+
+    def __init__(self, edition_ids, clusters):
+        self.editions = list(edition_ids)
+        self.clusters = clusters
+        self.cluster_of = {}
+        for cluster, witnesses in enumerate(clusters):
+            for edition_id, line in witnesses.items():
+                lines = self.cluster_of.setdefault(edition_id, array('i'))
+                if len(lines) <= line:
+                    lines.extend([-1] * (line + 1 - len(lines)))
+                lines[line] = cluster
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def cluster(self, edition_id, line):
+        """Cluster of a line, or None if the line is not in the apparatus."""
+        lines = self.cluster_of.get(edition_id)
+        if lines is None or not 0 <= line < len(lines) or lines[line] < 0:
+            return None
+        return lines[line]
+
+    def readings(self, edition_id, line):
+        """(edition, line) of every edition for the cluster of a line, None where it has no reading."""
+        cluster = self.cluster(edition_id, line)
+        if cluster is None:
+            return []
+        witnesses = self.clusters[cluster]
+        return [(witness, witnesses.get(witness)) for witness in self.editions]
+
+
+class ApparatusStore:
+    """The apparatus persisted in an SQLite file, one row per line.
+
+    Written by ``process_tei.py`` (or ``python apparatus.py`` to rebuild
+    from an existing ``texts_data.json``). The file records the content
+    hash of every source it was built from and the APPARATUS_VERSION; as
+    clustering spans all editions, any change to either makes the whole
+    table stale.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.executescript(SCHEMA)
+        # Files written before sources were versioned lack the column; they count as stale
+        if 'version' not in [column[1] for column in connection.execute("PRAGMA table_info(sources)")]:
+            connection.execute("ALTER TABLE sources ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        return connection
+
+    def _sources(self, connection):
+        """Position and hash of every source of the stored apparatus, empty unless it has the current version."""
+        sources = {
+            edition: (position, digest, version)
+            for edition, position, digest, version in connection.execute("SELECT edition, position, hash, version FROM sources")
+        }
+        if any(version != APPARATUS_VERSION for _, _, version in sources.values()):
+            return {}
+        return {edition: (position, digest) for edition, (position, digest, _) in sources.items()}
+
+    def load(self, hashes):
+        """Return the stored apparatus, or None if it is missing or was built from other sources."""
+        if not os.path.exists(self.path):
+            return None
+        with closing(self.connect()) as connection:
+            sources = self._sources(connection)
+            if not sources or {edition: digest for edition, (_, digest) in sources.items()} != hashes:
+                return None
+            clusters = defaultdict(dict)
+            for edition, line, cluster in connection.execute("SELECT edition, line, cluster FROM witnesses"):
+                clusters[cluster][edition] = line
+        edition_ids = sorted(sources, key=lambda edition: sources[edition][0])
+        return Apparatus(edition_ids, [clusters[cluster] for cluster in range(len(clusters))])
+
+    def build(self, editions, hashes, force=False):
+        """Cluster the lines of every edition unless the stored apparatus is current or ``force`` is set.
+
+        Returns the number of clusters written, or None if nothing changed.
+        """
+        with closing(self.connect()) as connection:
+            if not force and {edition: digest for edition, (_, digest) in self._sources(connection).items()} == hashes:
+                return None
+            clusters = cluster_lines(editions)
+            connection.execute("DELETE FROM sources")
+            connection.execute("DELETE FROM witnesses")
+            connection.executemany(
+                "INSERT INTO sources (edition, position, hash, version) VALUES (?, ?, ?, ?)",
+                [(edition, position, hashes[edition], APPARATUS_VERSION) for position, edition in enumerate(editions)]
+            )
+            connection.executemany(
+                "INSERT INTO witnesses (edition, line, cluster) VALUES (?, ?, ?)",
+                [(edition, line, cluster) for cluster, witnesses in enumerate(clusters) for edition, line in witnesses.items()]
+            )
+            connection.commit()
+        return len(clusters)
+
+
+if __name__ == '__main__':
+    from variant_store import source_hashes
+
+    with open('texts_data.json', 'r', encoding='utf-8') as f:
+        texts_data = json.load(f)
+    editions = {}
+    for entry in texts_data:
+        editions.setdefault(entry['edition'], []).append(entry)
+    clusters = ApparatusStore('apparatus.db').build(editions, source_hashes('data'))
+    print("Apparatus is up to date." if clusters is None else f"Clustered the lines into {clusters} apparatus entries.")
@@ -0,0 +1,125 @@
+"""Measure the cost of the collation engine against the old /compare diffing.
+
+The engine is not a speed-up over the old route: it does more work to get
+a correct alignment. /compare stays fast because it reads collations
+precomputed by process_tei.py from variants.db; this benchmark shows the
+cost of computing one pair, paid at build time or when the store is stale.
+
+Three timings are reported per edition pair:
+
+* keyed    -- the previous implementation, aligning on the exact
+              (act, scene, speaker, line_number) key. The editions carry no
+              line numbers, so this collapses each speaker's lines in a scene
+              into one and only diffs that handful of lines.
+* htmldiff -- one HtmlDiff table per line pair found by the collation engine,
+              i.e. what the previous rendering costs for every aligned line.
+* collate  -- the collation engine, including its word-level variants.
+
+The last two columns give the collation time as a multiple of the keyed
+route, which is what /compare ran before, and of the htmldiff timing; above
+1.0x the engine is slower. It is roughly 12x slower than the keyed route,
+which only diffs the few collapsed lines it manages to pair, while the
+engine aligns every line of both editions.
+
+Run from the repository root after ``python process_tei.py``:
+
+    python benchmarks/bench_collation.py [--pairs N] [--repeat N]
+"""
+import argparse
+import difflib
+import json
+import os
+import statistics
+import sys
+import time
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collation import collate  # noqa: E402
+
+
+def key_sorted_htmldiff(data1, data2, edition1, edition2):
+    """The previous /compare implementation: exact key alignment plus HtmlDiff per line."""
+    def organize_data(data):
+        organized = {}
+        for entry in data:
+            key = (entry.get('act'), entry.get('scene'), entry.get('speaker'), entry.get('line_number'))
+            organized[key] = entry
+        return organized
+
+    data1_organized = organize_data(data1)
+    data2_organized = organize_data(data2)
+    all_keys = sorted(set(data1_organized.keys()) | set(data2_organized.keys()),
+                      key=lambda key: tuple('' if part is None else part for part in key))
+    aligned_data = []
+    for key in all_keys:
+        e1 = data1_organized.get(key)
+        e2 = data2_organized.get(key)
+        diff = None
+        if e1 and e2:
+            diff = difflib.HtmlDiff().make_table(
+                [e1['text']], [e2['text']],
+                fromdesc=edition1, todesc=edition2,
+                context=True, numlines=0
+            )
+        aligned_data.append((e1, e2, diff))
+    return aligned_data
+
+
+def htmldiff_pairs(data1, data2, records, edition1, edition2):
+    """One HtmlDiff table per aligned line pair, as the old route rendered them."""
+    return [
+        difflib.HtmlDiff().make_table(
+            [data1[i]['text']], [data2[j]['text']],
+            fromdesc=edition1, todesc=edition2,
+            context=True, numlines=0
+        )
+        for scene, i, j, variants in records if variants is not None
+    ]
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--texts', default='texts_data.json', help='text data written by process_tei.py')
+    parser.add_argument('--pairs', type=int, default=5, help='number of edition pairs to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per pair; the median is reported')
+    args = parser.parse_args()
+
+    with open(args.texts, 'r', encoding='utf-8') as f:
+        texts_data = json.load(f)
+    editions = {}
+    for entry in texts_data:
+        editions.setdefault(entry['edition'], []).append(entry)
+
+    pairs = list(combinations(sorted(editions), 2))[:args.pairs]
+    print(f"{'edition pair':<48} {'keyed':>9} {'lines':>5} {'htmldiff':>9} {'collate':>9} {'lines':>5} "
+          f"{'/keyed':>7} {'/htmldiff':>9}")
+    totals = [0.0, 0.0, 0.0]
+    for edition1, edition2 in pairs:
+        data1, data2 = editions[edition1], editions[edition2]
+        keyed_time, keyed_rows = timed(lambda: key_sorted_htmldiff(data1, data2, edition1, edition2), args.repeat)
+        collate_time, records = timed(lambda: collate(data1, data2), args.repeat)
+        htmldiff_time, tables = timed(lambda: htmldiff_pairs(data1, data2, records, edition1, edition2), args.repeat)
+        totals[0] += keyed_time
+        totals[1] += htmldiff_time
+        totals[2] += collate_time
+        keyed_lines = sum(1 for e1, e2, diff in keyed_rows if diff)
+        print(f"{edition1 + ' / ' + edition2[4:]:<48} {keyed_time * 1000:>7.1f}ms {keyed_lines:>5} "
+              f"{htmldiff_time * 1000:>7.1f}ms {collate_time * 1000:>7.1f}ms {len(tables):>5} "
+              f"{collate_time / keyed_time:>6.1f}x {collate_time / htmldiff_time:>8.1f}x")
+    print(f"{'total':<48} {totals[0] * 1000:>7.1f}ms {'':>5} {totals[1] * 1000:>7.1f}ms "
+          f"{totals[2] * 1000:>7.1f}ms {'':>5} {totals[2] / totals[0]:>6.1f}x {totals[2] / totals[1]:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""Load-test the routes of app.py and compare the results with a baseline.
+
+The app is driven with the real editions in two ways:
+
+* client   -- in this process through Flask's test client, one request at a
+              time. Startup is the time to import the app.
+* gunicorn -- a local gunicorn server hit by --concurrency threads over
+              HTTP. Startup is the time until the server answers its first
+              request.
+
+Every route reports p50/p95/p99 latency and throughput. Each mode reports
+startup time and peak RSS; for gunicorn this is the sum over the master and
+its workers, read from /proc on Linux.
+
+The response cache is disabled unless --warm is given, so every request
+does the route's real work. Annotations go to a temporary SQLite database.
+
+Results are written as JSON to --output. When a baseline exists, every
+metric is compared with it; the script exits with status 1 if any latency
+or startup time grew, or any throughput fell, by more than --threshold.
+Routes whose mean latency moved by less than --min-delta-ms are ignored.
+
+Run from the repository root after ``python process_tei.py``:
+
+    python benchmarks/bench_routes.py [--mode client|gunicorn|both] [--requests N]
+    cp benchmarks/results/routes-latest.json benchmarks/results/routes-baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FOLDER = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Metrics compared with the baseline, and whether a higher value is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'throughput_rps': False,
+}
+COMPARED_MODE_METRICS = {
+    'startup_s': True,
+    'peak_rss_mb': True,
+}
+
+
+def editions_in_data():
+    return sorted(
+        os.path.splitext(name)[0] for name in os.listdir(os.path.join(ROOT, 'data')) if name.endswith('.xml')
+    )
+
+
+def route_urls(editions):
+    """Named routes, each with the URLs its requests cycle through."""
+    pairs = [(editions[i], editions[(i + 1) % len(editions)]) for i in range(len(editions))]
+    keywords = ['king', 'father', 'heaven', 'mother', 'death']
+    return {
+        'index': ['/'],
+        'edition': [f'/edition/{edition}' for edition in editions],
+        'scene': [f'/edition/{edition}/act/1/scene/2' for edition in editions],
+        'compare': [f'/compare?edition1={a}&edition2={b}' for a, b in pairs],
+        'compare_word_frequencies': [
+            f'/compare_word_frequencies?words={a},{b}' for a, b in zip(keywords, keywords[1:])
+        ],
+        'word_frequency': [f'/word_frequency?edition={edition}&num_words=50' for edition in editions],
+        'concordance': [f'/concordance?keyword={keyword}' for keyword in keywords],
+        'dispersion': [
+            f'/dispersion?keyword={keyword}&edition={edition}' for keyword in keywords for edition in editions[:3]
+        ],
+        'search': ['/search?query=to+be', '/search?query=%22my+lord%22', '/search?query=king+queen'],
+        'interactions': [f'/interactions/{edition}' for edition in editions],
+        'compare_interactions': [f'/compare_interactions?edition1={a}&edition2={b}' for a, b in pairs],
+        'keyness': [f'/keyness?edition={edition}' for edition in editions],
+        'tfidf': [f'/tfidf?edition={edition}&unit=scene' for edition in editions],
+        'collocations': [f'/collocations?keyword={keyword}' for keyword in keywords],
+        'ngrams': [f'/ngrams?edition={edition}&n={n}' for edition in editions for n in (2, 3)],
+        'api_concordance': [f'/api/v1/concordance?keyword={keyword}&limit=500' for keyword in keywords],
+        'api_search': ['/api/v1/search?query=to+be&format=ndjson'],
+    }
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile of a sorted list."""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(latencies, elapsed, sizes, errors):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'mean_bytes': round(sum(sizes) / len(sizes)),
+    }
+
+
+def app_environment(args, database_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database_path}')
+    if not args.warm:
+        env['RESPONSE_CACHE_SIZE'] = '0'
+        env.pop('RESPONSE_CACHE_DIR', None)
+    return env
+
+
+def run_client(args, routes, env):
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    import app  # noqa: E402
+    startup = time.perf_counter() - start
+    client = app.app.test_client()
+
+    results = {}
+    for name, urls in routes.items():
+        for url in urls[:args.warmup]:
+            client.get(url)
+        latencies, sizes, errors = [], [], 0
+        began = time.perf_counter()
+        for i in range(args.requests):
+            request_start = time.perf_counter()
+            response = client.get(urls[i % len(urls)])
+            body = response.get_data()
+            latencies.append(time.perf_counter() - request_start)
+            sizes.append(len(body))
+            errors += response.status_code >= 400
+        results[name] = summarize(latencies, time.perf_counter() - began, sizes, errors)
+        print_route(name, results[name])
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'startup_s': round(startup, 3), 'peak_rss_mb': round(peak_rss, 1), 'routes': results}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return pids
+    for child in children:
+        pids.extend(process_tree(child))
+    return pids
+
+
+def peak_rss_mb(pid):
+    """Sum of the peak resident sizes of a process and its descendants, or None off Linux."""
+    total = 0
+    for process in process_tree(pid):
+        try:
+            with open(f'/proc/{process}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            return None
+    return round(total / 1024, 1)
+
+
+def fetch(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=120) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body, status = e.read(), e.code
+    return time.perf_counter() - start, len(body), status
+
+
+def run_gunicorn(args, routes, env):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:app',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers),
+        '--threads', str(args.threads),
+        '--log-level', 'warning',
+    ]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited before serving a request")
+            try:
+                fetch(base + '/')
+                break
+            except OSError:
+                time.sleep(0.05)
+        startup = time.perf_counter() - start
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for name, urls in routes.items():
+                list(executor.map(fetch, [base + url for url in urls[:max(args.warmup, args.workers)]]))
+                began = time.perf_counter()
+                samples = list(executor.map(fetch, [base + urls[i % len(urls)] for i in range(args.requests)]))
+                elapsed = time.perf_counter() - began
+                results[name] = summarize(
+                    [latency for latency, size, status in samples], elapsed,
+                    [size for latency, size, status in samples],
+                    sum(status >= 400 for latency, size, status in samples)
+                )
+                print_route(name, results[name])
+        peak_rss = peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {'startup_s': round(startup, 3), 'peak_rss_mb': peak_rss, 'routes': results}
+
+
+def print_route(name, result):
+    print(f"  {name:<26} p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+          f"p99 {result['p99_ms']:>9.2f}ms  {result['throughput_rps']:>8.1f} req/s"
+          + (f"  {result['errors']} errors" if result['errors'] else ''))
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Print every metric next to the baseline; return the regressions beyond the threshold.
+
+    Route changes whose mean latency moved by less than ``min_delta_ms`` are
+    within timer noise and never count as regressions.
+    """
+    regressions = []
+    print(f"\nCompared with the baseline from {baseline['meta'].get('timestamp')} (threshold {threshold:.0%}):")
+    for mode, mode_results in results['modes'].items():
+        base_mode = baseline['modes'].get(mode)
+        if not base_mode:
+            print(f"  {mode}: not in the baseline")
+            continue
+        rows = [(mode, metric, base_mode.get(metric), mode_results.get(metric), higher_is_worse, True)
+                for metric, higher_is_worse in COMPARED_MODE_METRICS.items()]
+        for route, route_results in mode_results['routes'].items():
+            base_route = base_mode['routes'].get(route)
+            if base_route:
+                significant = abs(route_results['mean_ms'] - base_route['mean_ms']) >= min_delta_ms
+                rows.extend((f"{mode} {route}", metric, base_route.get(metric), route_results.get(metric),
+                             higher_is_worse, significant)
+                            for metric, higher_is_worse in COMPARED_METRICS.items())
+        for name, metric, old, new, higher_is_worse, significant in rows:
+            delta = change(old, new)
+            if delta is None:
+                continue
+            regressed = significant and (delta > threshold if higher_is_worse else delta < -threshold)
+            if regressed:
+                regressions.append((name, metric, old, new, delta))
+            print(f"  {name:<36} {metric:<15} {old:>10} -> {new:>10} {delta:>+8.1%}"
+                  + ("  REGRESSION" if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=['client', 'gunicorn', 'both'], default='client')
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per route first')
+    parser.add_argument('--routes', help='comma-separated route names to run (default: all)')
+    parser.add_argument('--warm', action='store_true', help='keep the response cache enabled')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients against gunicorn')
+    parser.add_argument('--output', default=os.path.join(RESULTS_FOLDER, 'routes-latest.json'))
+    parser.add_argument('--baseline', default=os.path.join(RESULTS_FOLDER, 'routes-baseline.json'))
+    parser.add_argument('--threshold', type=float, default=0.15, help='relative change reported as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='mean latency change below which a route never regresses')
+    args = parser.parse_args()
+
+    routes = route_urls(editions_in_data())
+    if args.routes:
+        routes = {name: routes[name] for name in args.routes.split(',')}
+    modes = ['client', 'gunicorn'] if args.mode == 'both' else [args.mode]
+
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'requests': args.requests,
+            'warm_cache': args.warm,
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+        },
+        'modes': {},
+    }
+    with tempfile.TemporaryDirectory() as folder:
+        env = app_environment(args, os.path.join(folder, 'annotations.db'))
+        # gunicorn runs first, before this process imports the app
+        for mode in sorted(modes, key=lambda mode: mode != 'gunicorn'):
+            print(f"{mode}:")
+            run = run_gunicorn if mode == 'gunicorn' else run_client
+            results['modes'][mode] = run(args, routes, env)
+            print(f"  startup {results['modes'][mode]['startup_s']}s, "
+                  f"peak RSS {results['modes'][mode]['peak_rss_mb']} MB")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+    print(f"\nResults written to {args.output}")
+
+    if os.path.abspath(args.baseline) != os.path.abspath(args.output) and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import math
+from collections import Counter, OrderedDict, defaultdict
+from difflib import SequenceMatcher
+
+from token_index import normalize_token, tokenize
+
+# Minimum Jaccard similarity for two differing lines to be collated together
+MIN_LINE_SIMILARITY = 0.3
+
+def scene_lines(data):
+    """Group the line indices of an edition by (act, scene), in text order."""
+    scenes = OrderedDict()
+    for i, entry in enumerate(data):
+        scenes.setdefault((entry.get('act'), entry.get('scene')), []).append(i)
+    return scenes
+
+
+def edition_tokens(data):
+    """Normalized words of every line of an edition, aligned with ``text.split()``."""
+    # Most words recur, so normalize each distinct spelling once
+    normalized = {}
+    tokens = []
+    for entry in data:
+        terms = []
+        for word in entry['text'].split():
+            term = normalized.get(word)
+            if term is None:
+                term = normalized[word] = normalize_token(word)
+            terms.append(term)
+        tokens.append(terms)
+    return tokens
+
+
+def _line_keys(tokens, lines):
+    return [tuple(term for term in tokens[i] if term) for i in lines]
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+def word_ranks(keys):
+    """Rank of every word of some lines, rarest first, for prefix filtering."""
+    frequency = Counter(word for key in keys for word in set(key))
+    return {word: k for k, word in enumerate(sorted(frequency, key=lambda word: (frequency[word], word)))}
+
+
+def _similar_pairs(sets1, sets2, rank=None):
+    """Find every pair of lines with at least MIN_LINE_SIMILARITY word overlap.
+
+    Uses prefix filtering: with words in a fixed order, two sets whose
+    Jaccard similarity reaches the threshold must share a word among the
+    first ``len(s) - ceil(threshold * len(s)) + 1`` words of each set, so
+    only pairs sharing such a word are compared. Ordering the words rarest
+    first keeps those prefixes selective; ``rank`` gives that order, by
+    default from the two blocks themselves.
+    """
+    if rank is None:
+        rank = word_ranks(sets1 + sets2)
+
+    def prefix(words):
+        ordered = sorted(words, key=rank.__getitem__)
+        return ordered[:len(words) - math.ceil(MIN_LINE_SIMILARITY * len(words)) + 1]
+
+    prefix_index = defaultdict(list)
+    for j, words in enumerate(sets2):
+        for word in prefix(words):
+            prefix_index[word].append(j)
+
+    pairs = []
+    for i, words in enumerate(sets1):
+        candidates = {j for word in prefix(words) for j in prefix_index.get(word, ())}
+        for j in sorted(candidates):
+            similarity = _similarity(words, sets2[j])
+            if similarity >= MIN_LINE_SIMILARITY:
+                pairs.append((i, j, similarity))
+    return pairs
+
+
+def heaviest_chain(pairs, n):
+    """Heaviest in-order chain of weighted (i, j, weight) pairs.
+
+    Pairs must be sorted by ``i``, and ``j`` is below ``n``. Returns the
+    (i, j) pairs, increasing in both, whose weights add up to the most,
+    with each ``i`` and each ``j`` used at most once. Runs in
+    O(len(pairs) log n) with a Fenwick tree of running maxima over ``j``.
+    """
+    # tree[k] holds the best (score, pair) of a chain ending at j < k
+    tree = [(0.0, -1)] * (n + 1)
+    chain_scores = [0.0] * len(pairs)
+    previous = [-1] * len(pairs)
+    start = 0
+    while start < len(pairs):
+        # Query every pair of line i before updating, so a line pairs at most once
+        end = start
+        while end < len(pairs) and pairs[end][0] == pairs[start][0]:
+            end += 1
+        for k in range(start, end):
+            best, position = (0.0, -1), pairs[k][1]
+            while position > 0:
+                if tree[position][0] > best[0]:
+                    best = tree[position]
+                position -= position & -position
+            chain_scores[k] = best[0] + pairs[k][2]
+            previous[k] = best[1]
+        for k in range(start, end):
+            position = pairs[k][1] + 1
+            while position <= n:
+                if chain_scores[k] > tree[position][0]:
+                    tree[position] = (chain_scores[k], k)
+                position += position & -position
+        start = end
+
+    chain = []
+    k = max(range(len(pairs)), key=chain_scores.__getitem__, default=-1)
+    while k != -1:
+        chain.append(pairs[k][:2])
+        k = previous[k]
+    chain.reverse()
+    return chain
+
+
+def _align_block(keys1, keys2, rank=None):
+    """Pair up two blocks of differing lines by word overlap.
+
+    Finds the in-order set of line pairs with the largest total Jaccard
+    similarity (a heaviest common subsequence) among the pairs that reach
+    MIN_LINE_SIMILARITY. Returns (i, j) pairs with None for unpaired lines.
+    """
+    m, n = len(keys1), len(keys2)
+    pairs = _similar_pairs([frozenset(key) for key in keys1], [frozenset(key) for key in keys2], rank)
+    chain = heaviest_chain(pairs, n)
+
+    # Interleave the paired lines with the unpaired ones, in reading order
+    aligned = []
+    i = j = 0
+    for pair_i, pair_j in chain + [(m, n)]:
+        aligned += [(k, None) for k in range(i, pair_i)] + [(None, k) for k in range(j, pair_j)]
+        if pair_i < m:
+            aligned.append((pair_i, pair_j))
+        i, j = pair_i + 1, pair_j + 1
+    return aligned
+
+
+def align_scene(keys1, keys2, rank=None):
+    """Align two scenes given the normalized tokens of their lines.
+
+    Identical lines anchor the alignment; the blocks between anchors are
+    paired by word overlap, with words ordered by ``rank`` (see
+    ``word_ranks``). Returns (i, j) index pairs into the two scenes, with
+    None for a line that has no counterpart.
+    """
+    pairs = []
+    matcher = SequenceMatcher(None, keys1, keys2, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+        else:
+            for i, j in _align_block(keys1[i1:i2], keys2[j1:j2], rank):
+                pairs.append((None if i is None else i1 + i, None if j is None else j1 + j))
+    return pairs
+
+
+def word_variants(text1, text2, terms1=None, terms2=None):
+    """Compare two lines word by word and list the differing readings.
+
+    Words are compared in normalized form, so differences in case and
+    surrounding punctuation alone are not reported; ``terms1`` and
+    ``terms2`` are those forms if already tokenized. Each variant is a dict
+    with the operation ('replace', 'delete' or 'insert') and the original
+    words of both lines.
+    """
+    words1, words2 = text1.split(), text2.split()
+    terms1 = tokenize(text1) if terms1 is None else terms1
+    terms2 = tokenize(text2) if terms2 is None else terms2
+    matcher = SequenceMatcher(None, terms1, terms2, autojunk=False)
+    variants = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        # Skip differences that are nothing but punctuation
+        if tag != 'equal' and any(terms1[i1:i2] + terms2[j1:j2]):
+            variants.append({
+                'op': tag,
+                'a': ' '.join(words1[i1:i2]),
+                'b': ' '.join(words2[j1:j2]),
+            })
+    return variants
+
+
+def collate(data1, data2, tokens1=None, tokens2=None):
+    """Collate two editions scene by scene.
+
+    Returns a list of (scene, i, j, variants) records in reading order, where
+    ``scene`` is the (act, scene) key, ``i`` and ``j`` are line indices into
+    ``data1`` and ``data2`` (None if the line has no counterpart) and
+    ``variants`` lists the word-level differences of an aligned pair (None
+    for unaligned lines). ``tokens1`` and ``tokens2`` are the editions'
+    ``edition_tokens``, when collating an edition against several others.
+    """
+    tokens1 = edition_tokens(data1) if tokens1 is None else tokens1
+    tokens2 = edition_tokens(data2) if tokens2 is None else tokens2
+    scenes1 = scene_lines(data1)
+    scenes2 = scene_lines(data2)
+    # One word order for the prefix filtering of every block, instead of one per block
+    rank = word_ranks(tokens1 + tokens2)
+    records = []
+    for scene in list(scenes1) + [scene for scene in scenes2 if scene not in scenes1]:
+        lines1 = scenes1.get(scene, [])
+        lines2 = scenes2.get(scene, [])
+        keys1 = _line_keys(tokens1, lines1)
+        keys2 = _line_keys(tokens2, lines2)
+        for a, b in align_scene(keys1, keys2, rank):
+            i = None if a is None else lines1[a]
+            j = None if b is None else lines2[b]
+            variants = None
+            if i is not None and j is not None:
+                if keys1[a] == keys2[b]:
+                    variants = []
+                else:
+                    variants = word_variants(data1[i]['text'], data2[j]['text'], tokens1[i], tokens2[j])
+            records.append((scene, i, j, variants))
+    return records
@@ -0,0 +1,215 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
+
+# File layout (native little-endian arrays):
+#   magic, header length (uint32), JSON header, padding to 8 bytes,
+#   one array per column, each padded to 8 bytes,
+#   the UTF-8 text of every line back to back.
+# The header holds per-edition metadata, the interned string tables and the
+# offset, length and type code of every column.
+MAGIC = b'HAMCORP1'
+PREFIX = struct.Struct('<8sI')
+
+# Line fields stored as indexes into an interned string table
+INTERNED_FIELDS = ['act', 'scene', 'speaker', 'line_number']
+
+# Line fields repeated from the edition's metadata
+METADATA_FIELDS = ['title', 'author', 'date']
+
+
+def _padding(length):
+    return b'\0' * (-length % 8)
+
+
+def _typecode(size):
+    """Smallest unsigned array type code that can index ``size`` values."""
+    for code in 'BHIQ':
+        if size <= 256 ** array(code).itemsize:
+            return code
+    return 'Q'
+
+
+def encode_corpus(texts_data):
+    """Encode a list of line entries as a columnar corpus."""
+    editions = OrderedDict()
+    strings = {field: [] for field in INTERNED_FIELDS}
+    string_ids = {field: {} for field in INTERNED_FIELDS}
+    columns = {field: [] for field in INTERNED_FIELDS}
+    text_offsets = [0]
+    text = bytearray()
+
+    for i, entry in enumerate(texts_data):
+        edition = editions.get(entry['edition'])
+        if edition is None:
+            edition = editions[entry['edition']] = {'id': entry['edition'], 'start': i}
+            edition.update((field, entry.get(field, '')) for field in METADATA_FIELDS)
+        edition['end'] = i + 1
+        for field in INTERNED_FIELDS:
+            value = entry.get(field)
+            if value not in string_ids[field]:
+                string_ids[field][value] = len(strings[field])
+                strings[field].append(value)
+            columns[field].append(string_ids[field][value])
+        text += entry['text'].encode('utf-8')
+        text_offsets.append(len(text))
+
+    arrays = [(field, array(_typecode(len(strings[field])), columns[field])) for field in INTERNED_FIELDS]
+    arrays.append(('text_offsets', array(_typecode(len(text) + 1), text_offsets)))
+
+    # Lay the columns out after the header; offsets are relative to the data section
+    layout = {}
+    data = bytearray()
+    for name, values in arrays:
+        layout[name] = [len(data), len(values), values.typecode]
+        data += values.tobytes()
+        data += _padding(len(data))
+    layout['text'] = [len(data), len(text), 'B']
+    data += text
+
+    header = json.dumps({
+        'lines': len(text_offsets) - 1,
+        'editions': list(editions.values()),
+        'strings': strings,
+        'columns': layout,
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    prefix = PREFIX.pack(MAGIC, len(header)) + header
+    return bytes(prefix + _padding(len(prefix)) + data)
+
+
+def write_corpus(path, texts_data):
+    data = encode_corpus(texts_data)
+    # Write to a temporary file and rename it: workers mapping the old file keep
+    # reading it intact instead of seeing it truncated and rewritten under them
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+class Corpus(Sequence):
+    """Read-only view of a columnar corpus, usually memory-mapped from disk.
+
+    Lines are decoded into the same dicts as the entries of texts_data.json
+    on access, so a corpus can stand in for that list. Every worker mapping
+    the same file shares its pages through the OS page cache.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        magic, header_length = PREFIX.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a corpus file.")
+        header_end = PREFIX.size + header_length
+        header = json.loads(bytes(self.buffer[PREFIX.size:header_end]))
+        data = self.buffer[header_end + len(_padding(header_end)):]
+
+        self.length = header['lines']
+        self.strings = header['strings']
+        self.columns = {}
+        for name, (offset, count, typecode) in header['columns'].items():
+            size = count * array(typecode).itemsize
+            column = data[offset:offset + size]
+            self.columns[name] = column.cast(typecode) if typecode != 'B' else column
+
+        self.edition_metadata = OrderedDict((edition['id'], edition) for edition in header['editions'])
+        self.editions = OrderedDict(
+            (edition_id, EditionLines(self, edition)) for edition_id, edition in self.edition_metadata.items()
+        )
+        # First line of every edition, for lookups by corpus line index
+        self.edition_starts = [edition['start'] for edition in header['editions']]
+        self.edition_order = list(self.edition_metadata.values())
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_entries(cls, texts_data):
+        return cls(encode_corpus(texts_data))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.line(j) for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("corpus line index out of range")
+        return self.line(i)
+
+    def __iter__(self):
+        for edition in self.editions.values():
+            yield from edition
+
+    def text(self, i):
+        offsets = self.columns['text_offsets']
+        return str(self.columns['text'][offsets[i]:offsets[i + 1]], 'utf-8')
+
+    def line(self, i):
+        edition = self.edition_order[bisect_right(self.edition_starts, i) - 1]
+        return self._entry(edition, i)
+
+    def _entry(self, edition, i):
+        entry = {'edition': edition['id']}
+        entry.update((field, edition[field]) for field in METADATA_FIELDS)
+        entry.update((field, self.strings[field][self.columns[field][i]]) for field in INTERNED_FIELDS)
+        entry['text'] = self.text(i)
+        return entry
+
+
+class EditionLines(Sequence):
+    """The lines of one edition, a contiguous range of the corpus."""
+
+    def __init__(self, corpus, metadata):
+        self.corpus = corpus
+        self.metadata = metadata
+        self.start = metadata['start']
+        self.end = metadata['end']
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.corpus._entry(self.metadata, self.start + j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("edition line index out of range")
+        return self.corpus._entry(self.metadata, self.start + i)
+
+    def __iter__(self):
+        for i in range(self.start, self.end):
+            yield self.corpus._entry(self.metadata, i)
+
+    def __bool__(self):
+        return self.end > self.start
+
+    def scene_lines(self):
+        """Map act -> scene -> line indices within the edition, in reading order.
+
+        Reads only the act and scene columns, without decoding any lines.
+        Lines missing an act or scene are grouped under 'Unknown Act' and
+        'Unknown Scene'.
+        """
+        acts = OrderedDict()
+        act_column = self.corpus.columns['act']
+        scene_column = self.corpus.columns['scene']
+        act_strings = self.corpus.strings['act']
+        scene_strings = self.corpus.strings['scene']
+        for i in range(self.start, self.end):
+            act_num = act_strings[act_column[i]] or 'Unknown Act'
+            scene_num = scene_strings[scene_column[i]] or 'Unknown Scene'
+            acts.setdefault(act_num, OrderedDict()).setdefault(scene_num, []).append(i - self.start)
+        return acts
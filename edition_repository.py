@@ -0,0 +1,91 @@
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+def _entries_size(entries):
+    """Approximate memory held by a list of decoded line entries."""
+    return sys.getsizeof(entries) + sum(
+        sys.getsizeof(entry) + sys.getsizeof(entry['text']) for entry in entries
+    )
+
+
+class EditionRepository(Mapping):
+    """Editions decoded from the corpus on first access, kept in a bounded LRU.
+
+    Behaves like the old ``editions`` dict of edition id to list of line
+    entries. Listing or testing edition ids never decodes anything; reading
+    an edition decodes all of its lines and caches them. Once more than
+    ``max_editions`` editions or ``max_bytes`` bytes of entries are cached,
+    the least recently used editions are evicted. Either limit may be None.
+    """
+
+    def __init__(self, corpus, max_editions=None, max_bytes=None):
+        self.corpus = corpus
+        self.max_editions = max_editions
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self, edition_id):
+        with self.lock:
+            cached = self.cache.get(edition_id)
+            if cached is not None:
+                self.cache.move_to_end(edition_id)
+                self.hits += 1
+                return cached[0]
+        # Decode outside the lock; a concurrent miss on the same edition
+        # decodes it twice, which is harmless
+        entries = list(self.corpus.editions[edition_id])
+        size = _entries_size(entries)
+        with self.lock:
+            self.misses += 1
+            if edition_id not in self.cache:
+                self.cache[edition_id] = (entries, size)
+                self.cached_bytes += size
+                self._evict()
+        return entries
+
+    def __iter__(self):
+        return iter(self.corpus.editions)
+
+    def __len__(self):
+        return len(self.corpus.editions)
+
+    def __contains__(self, edition_id):
+        return edition_id in self.corpus.editions
+
+    def _evict(self):
+        # Always keep the most recently loaded edition, even if it is over the limit
+        while len(self.cache) > 1 and (
+            (self.max_editions is not None and len(self.cache) > self.max_editions) or
+            (self.max_bytes is not None and self.cached_bytes > self.max_bytes)
+        ):
+            _, (_, size) = self.cache.popitem(last=False)
+            self.cached_bytes -= size
+            self.evictions += 1
+
+    def line(self, edition_id, i):
+        """One line of an edition, without loading the edition if it is not cached."""
+        with self.lock:
+            cached = self.cache.get(edition_id)
+        if cached is not None:
+            return cached[0][i]
+        return self.corpus.editions[edition_id][i]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'cached_editions': len(self.cache),
+                'cached_bytes': self.cached_bytes,
+                'max_editions': self.max_editions,
+                'max_bytes': self.max_bytes,
+            }
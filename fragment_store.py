@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from markupsafe import Markup
+from werkzeug.utils import secure_filename
+from whitenoise.compress import Compressor
+
+# Annotation markers as written by annotation_marker; their keys never contain "--"
+MARKER_PATTERN = re.compile(r'<!--annotations .*?-->')
+
+
+def annotation_marker(act, scene, speaker, line_number):
+    """HTML comment standing for the annotations of a line in a pre-rendered fragment."""
+    # A comment cannot contain "--", so escape it inside the key
+    key = json.dumps([act, scene, speaker, line_number], ensure_ascii=False).replace('--', '-\\u002d')
+    return Markup(f"<!--annotations {key}-->")
+
+
+def splice_annotations(html, annotations, render):
+    """Insert ``render(texts)`` after the marker of every annotated line of a fragment."""
+    if not annotations:
+        return html
+    # One pass over the markers, looking each up, instead of one replace per annotated line
+    by_marker = {str(annotation_marker(*key)): texts for key, texts in annotations.items()}
+
+    def splice(match):
+        marker = match.group(0)
+        texts = by_marker.get(marker)
+        return marker if texts is None else marker + render(texts)
+
+    return MARKER_PATTERN.sub(splice, html)
+
+
+def fragment_version(hashes, template_paths):
+    """Version of the fragments: the source hashes plus the templates they are rendered from."""
+    digest = hashlib.sha256(json.dumps(hashes, sort_keys=True).encode('utf-8'))
+    for path in template_paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class FragmentStore:
+    """Pre-rendered HTML of every edition and scene, without annotations.
+
+    Fragments are written to ``root/<version>/<edition>/``: ``edition.html``
+    for the whole text and ``<act>-<scene>.html`` per scene, each with
+    compressed copies next to it. With ``root`` inside the static folder,
+    WhiteNoise serves them at ``url_prefix`` under the same paths. A new
+    corpus or template version writes a new directory, so a page never
+    mixes versions; ``prune`` removes the others.
+    """
+
+    def __init__(self, root, version, url_prefix='/fragments'):
+        self.root = root
+        self.version = version
+        self.directory = os.path.join(root, version)
+        self.url_prefix = url_prefix
+        self.compressor = Compressor(quiet=True)
+
+    def _name(self, edition_id, act=None, scene=None):
+        name = 'edition.html' if act is None else f"{secure_filename(str(act))}-{secure_filename(str(scene))}.html"
+        return f"{secure_filename(edition_id)}/{name}"
+
+    def path(self, edition_id, act=None, scene=None):
+        return os.path.join(self.directory, self._name(edition_id, act, scene))
+
+    def url(self, edition_id, act=None, scene=None):
+        return f"{self.url_prefix}/{self.version}/{self._name(edition_id, act, scene)}"
+
+    def read(self, edition_id, act=None, scene=None):
+        """The fragment's HTML, or None if it has not been rendered."""
+        try:
+            with open(self.path(edition_id, act, scene), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, html, edition_id, act=None, scene=None):
+        path = self.path(edition_id, act, scene)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename it, so readers never see a partial fragment
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(html)
+        # mkstemp creates the file private to its owner; the web server may run as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        self.compressor.compress(path)
+        return path
+
+    def prune(self):
+        """Remove the fragments of every other version."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name != self.version:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,222 @@
+import numpy as np
+
+# Power iterations for eigenvector centrality, and the tolerance to stop at
+EIGENVECTOR_ITERATIONS = 200
+EIGENVECTOR_TOLERANCE = 1e-9
+
+
+def split_pair(pair_str):
+    character1, character2 = pair_str.split('-')
+    return character1, character2
+
+
+def eigenvector_centrality(adjacency):
+    """Eigenvector centrality of every node, for a stack of adjacency matrices.
+
+    Power iteration on ``A + I``; the shift keeps the iteration from
+    oscillating on bipartite graphs without changing the eigenvectors.
+    Each edition's vector is scaled to unit length.
+    """
+    editions, n, _ = adjacency.shape
+    shifted = adjacency + np.eye(n)
+    present = adjacency.sum(axis=2) > 0
+    x = present / np.maximum(np.linalg.norm(present, axis=1, keepdims=True), 1)
+    for _ in range(EIGENVECTOR_ITERATIONS):
+        y = np.einsum('eij,ej->ei', shifted, x) * present
+        y /= np.maximum(np.linalg.norm(y, axis=1, keepdims=True), 1e-12)
+        if np.abs(y - x).max() < EIGENVECTOR_TOLERANCE:
+            return y
+        x = y
+    return x
+
+
+def clustering_coefficients(adjacency):
+    """Unweighted local clustering coefficient for a stack of adjacency matrices."""
+    links = (adjacency > 0).astype(float)
+    triangles = np.einsum('eij,ejk,eki->ei', links, links, links) / 2
+    degree = links.sum(axis=2)
+    possible = degree * (degree - 1) / 2
+    return np.divide(triangles, possible, out=np.zeros_like(triangles), where=possible > 0)
+
+
+def betweenness_centrality(adjacency):
+    """Normalized shortest-path betweenness for a stack of unweighted graphs.
+
+    Distances and shortest-path counts come from breadth-first expansion with
+    matrix products; node v lies on a shortest s-t path exactly when
+    ``d(s, v) + d(v, t) == d(s, t)``, and then carries
+    ``sigma(s, v) * sigma(v, t) / sigma(s, t)`` of the pair's paths.
+    """
+    editions, n, _ = adjacency.shape
+    links = (adjacency > 0).astype(float)
+    distance = np.full((editions, n, n), np.inf)
+    paths = np.zeros((editions, n, n))
+    frontier = np.broadcast_to(np.eye(n), (editions, n, n)).copy()
+    distance[frontier > 0] = 0
+    paths[frontier > 0] = 1
+    for step in range(1, n):
+        # Paths of length `step` to nodes not reached by a shorter one
+        frontier = np.matmul(frontier, links) * np.isinf(distance)
+        if not frontier.any():
+            break
+        reached = frontier > 0
+        distance[reached] = step
+        paths[reached] = frontier[reached]
+
+    betweenness = np.zeros((editions, n))
+    reachable = np.isfinite(distance) & ~np.eye(n, dtype=bool)
+    for v in range(n):
+        # Pairs (s, t) whose shortest paths pass through v, with s, t != v
+        through = (distance[:, :, v, None] + distance[:, None, v, :] == distance) & reachable
+        through[:, v, :] = False
+        through[:, :, v] = False
+        share = paths[:, :, v, None] * paths[:, None, v, :] / np.where(paths > 0, paths, 1)
+        betweenness[:, v] = (share * through).sum(axis=(1, 2)) / 2
+
+    present = (adjacency.sum(axis=2) > 0).sum(axis=1)
+    scale = np.where(present > 2, (present - 1) * (present - 2) / 2, 1)
+    return betweenness / scale[:, None]
+
+
+def communities(adjacency):
+    """Community label of every node by greedy modularity maximization.
+
+    Starts from one community per node and repeatedly merges the two linked
+    communities whose merge raises weighted modularity the most, until no
+    merge does. Ties go to the lowest indices, so the result is
+    deterministic. Labels are renumbered from 0 by first appearance; nodes
+    without links get -1.
+    """
+    n = adjacency.shape[0]
+    total = adjacency.sum()
+    labels = np.arange(n)
+    if total == 0:
+        return [-1] * n
+    # Fraction of link weight between every pair of communities, and at each community
+    between = adjacency / total
+    share = between.sum(axis=1)
+    alive = share > 0
+    while True:
+        gain = 2 * (between - np.outer(share, share))
+        linked = (between > 0) & np.outer(alive, alive)
+        np.fill_diagonal(linked, False)
+        if not linked.any():
+            break
+        gain = np.where(linked, gain, -np.inf)
+        a, b = np.unravel_index(np.argmax(gain), gain.shape)
+        if gain[a, b] <= 0:
+            break
+        a, b = min(a, b), max(a, b)
+        # Fold community b into community a
+        between[a] += between[b]
+        between[:, a] += between[:, b]
+        between[b] = 0
+        between[:, b] = 0
+        share[a] += share[b]
+        share[b] = 0
+        alive[b] = False
+        labels[labels == b] = a
+    order = {}
+    linked = adjacency.sum(axis=1) > 0
+    return [order.setdefault(label, len(order)) if linked[node] else -1 for node, label in enumerate(labels)]
+
+
+class InteractionGraphs:
+    """Character interaction networks of every edition, with precomputed metrics.
+
+    All editions share one character index, so each edition is a slice of a
+    single (editions x characters x characters) array of symmetric,
+    weighted adjacency matrices. Node metrics are computed once for every
+    edition at construction; graph differences between two editions are
+    array operations on their slices.
+    """
+
+    def __init__(self, interaction_data_raw):
+        self.editions = list(interaction_data_raw)
+        self.edition_index = {edition: i for i, edition in enumerate(self.editions)}
+        self.characters = sorted({
+            character
+            for pairs in interaction_data_raw.values()
+            for pair_str in pairs
+            for character in split_pair(pair_str)
+        })
+        self.character_index = {character: i for i, character in enumerate(self.characters)}
+
+        n = len(self.characters)
+        self.adjacency = np.zeros((len(self.editions), n, n))
+        for edition, pairs in interaction_data_raw.items():
+            e = self.edition_index[edition]
+            for pair_str, count in pairs.items():
+                i, j = (self.character_index[character] for character in split_pair(pair_str))
+                self.adjacency[e, i, j] += count
+                self.adjacency[e, j, i] += count
+
+        self.present = self.adjacency.sum(axis=2) > 0
+        self.weighted_degree = self.adjacency.sum(axis=2)
+        if self.adjacency.size:
+            self.betweenness = betweenness_centrality(self.adjacency)
+            self.eigenvector = eigenvector_centrality(self.adjacency)
+            self.clustering = clustering_coefficients(self.adjacency)
+            self.communities = np.array([communities(matrix) for matrix in self.adjacency], dtype=int).reshape(self.present.shape)
+        else:
+            # No editions or no characters (interaction data missing): empty graphs
+            self.betweenness = self.eigenvector = self.clustering = np.zeros(self.present.shape)
+            self.communities = np.zeros(self.present.shape, dtype=int)
+
+        # Node and link lists for the views, built once per edition
+        self.graphs = {edition: self._graph(self.edition_index[edition]) for edition in self.editions}
+
+    def __contains__(self, edition):
+        return edition in self.edition_index
+
+    def get(self, edition):
+        return self.graphs.get(edition)
+
+    def _nodes(self, e):
+        return [
+            {
+                'id': self.characters[i],
+                'degree': int(self.weighted_degree[e, i]),
+                'betweenness': round(float(self.betweenness[e, i]), 4),
+                'eigenvector': round(float(self.eigenvector[e, i]), 4),
+                'clustering': round(float(self.clustering[e, i]), 4),
+                'community': int(self.communities[e, i]),
+            }
+            for i in np.nonzero(self.present[e])[0]
+        ]
+
+    def _graph(self, e):
+        sources, targets = np.nonzero(np.triu(self.adjacency[e], k=1))
+        links = [
+            {'source': self.characters[i], 'target': self.characters[j], 'value': int(self.adjacency[e, i, j])}
+            for i, j in zip(sources, targets)
+        ]
+        return {'nodes': self._nodes(e), 'links': links}
+
+    def diff(self, edition1, edition2):
+        """Merged nodes and links of two editions, with each link's weight in both."""
+        e1, e2 = self.edition_index[edition1], self.edition_index[edition2]
+        adjacency1, adjacency2 = self.adjacency[e1], self.adjacency[e2]
+        present = self.present[e1] | self.present[e2]
+        nodes = [
+            {
+                'id': self.characters[i],
+                'degree1': int(self.weighted_degree[e1, i]),
+                'degree2': int(self.weighted_degree[e2, i]),
+            }
+            for i in np.nonzero(present)[0]
+        ]
+
+        in1, in2 = adjacency1 > 0, adjacency2 > 0
+        sources, targets = np.nonzero(np.triu(in1 | in2, k=1))
+        links = []
+        for i, j in zip(sources, targets):
+            link_editions = ([edition1] if in1[i, j] else []) + ([edition2] if in2[i, j] else [])
+            links.append({
+                'source': self.characters[i],
+                'target': self.characters[j],
+                'value1': int(adjacency1[i, j]),
+                'value2': int(adjacency2[i, j]),
+                'editions': link_editions,
+            })
+        return nodes, links
@@ -0,0 +1,143 @@
+import heapq
+import re
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from token_index import NO_TERM, tokenize
+
+# A single occurrence of a term: the line it is on (an index into the
+# edition's list of entries) and the word position within that line
+Posting = namedtuple('Posting', ['edition', 'line', 'position'])
+
+# Double-quoted phrases or bare words in a search query
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+
+class InvertedIndex:
+    """Positional postings for every normalized term, built from a TokenIndex.
+
+    For each term and edition the index keeps the sorted stream positions at
+    which the term occurs. Stream positions are turned back into (line, word
+    position) pairs with the edition's line offsets.
+    """
+
+    def __init__(self, token_index):
+        self.token_index = token_index
+        self.postings = {}
+        for edition_id, data in token_index.editions.items():
+            for position, term_id in enumerate(data['tokens']):
+                if term_id == NO_TERM:
+                    continue
+                by_edition = self.postings.setdefault(term_id, {})
+                positions = by_edition.get(edition_id)
+                if positions is None:
+                    positions = by_edition[edition_id] = array('I')
+                positions.append(position)
+
+    def _term_postings(self, term):
+        term_id = self.token_index.term_ids.get(term)
+        if term_id is None:
+            return {}
+        return self.postings.get(term_id, {})
+
+    def positions(self, edition_id, term):
+        """Stream positions of a normalized term in one edition."""
+        return list(self._term_postings(term).get(edition_id, ()))
+
+    def stream_position(self, posting):
+        """Position of a posting in its edition's token stream."""
+        return self.token_index.editions[posting.edition]['line_offsets'][posting.line] + posting.position
+
+    def lookup_any(self, terms, edition_ids=None, after=None):
+        """Yield a Posting for every occurrence of any of several normalized terms, in text order.
+
+        Editions are visited in corpus order; ``edition_ids`` restricts the
+        lookup to the given editions. ``after``, an (edition, stream
+        position) pair, resumes the lookup with the first occurrence past
+        that position.
+        """
+        postings = [self._term_postings(term) for term in dict.fromkeys(terms)]
+        for edition_id in self.token_index.editions:
+            resume = None
+            if after is not None:
+                # Skip the editions before the one to resume in
+                if edition_id != after[0]:
+                    continue
+                resume, after = after[1], None
+            if edition_ids and edition_id not in edition_ids:
+                continue
+            streams = [by_edition[edition_id] for by_edition in postings if edition_id in by_edition]
+            if resume is not None:
+                streams = [stream[bisect_right(stream, resume):] for stream in streams]
+            if not streams:
+                continue
+            line_offsets = self.token_index.editions[edition_id]['line_offsets']
+            for position in (streams[0] if len(streams) == 1 else heapq.merge(*streams)):
+                line = bisect_right(line_offsets, position) - 1
+                yield Posting(edition_id, line, position - line_offsets[line])
+
+    def phrase_any(self, alternatives, edition_ids=None, after=None):
+        """Yield a Posting for the first word of every occurrence of a phrase.
+
+        ``alternatives`` lists the accepted terms for every word of the
+        phrase. A phrase only matches within a single line.
+        """
+        if not alternatives:
+            return
+        if len(alternatives) == 1:
+            yield from self.lookup_any(alternatives[0], edition_ids, after)
+            return
+        term_ids = self.token_index.term_ids
+        accepted = [{term_ids[term] for term in terms if term in term_ids} for terms in alternatives]
+        if not all(accepted):
+            return
+        for posting in self.lookup_any(alternatives[0], edition_ids, after):
+            data = self.token_index.editions[posting.edition]
+            start = data['line_offsets'][posting.line] + posting.position
+            if start + len(accepted) > data['line_offsets'][posting.line + 1]:
+                continue
+            if all(data['tokens'][start + i] in ids for i, ids in enumerate(accepted[1:], 1)):
+                yield posting
+
+    def search(self, query, edition_ids=None, expand=None, after=None):
+        """Return the sorted (edition, line) pairs matching every query clause.
+
+        Bare words must all occur in a line; double-quoted words must occur
+        next to each other in that order. ``expand`` maps a query word to
+        the list of terms it matches, by default only itself. With an
+        (edition, line) pair ``after``, only the matches past it are returned.
+        """
+        expand = expand or (lambda term: [term])
+        clauses = []
+        for phrase, word in QUERY_PATTERN.findall(query):
+            terms = [term for term in tokenize(phrase or word) if term]
+            if phrase:
+                clauses.append([expand(term) for term in terms])
+            else:
+                clauses.extend([expand(term)] for term in terms)
+        clauses = [alternatives for alternatives in clauses if alternatives]
+        if not clauses:
+            return []
+
+        # Start from the rarest clause so intersections stay small
+        def clause_size(alternatives):
+            return sum(
+                len(positions)
+                for term in alternatives[0]
+                for positions in self._term_postings(term).values()
+            )
+        clauses.sort(key=clause_size)
+
+        matches = None
+        for alternatives in clauses:
+            lines = {(posting.edition, posting.line) for posting in self.phrase_any(alternatives, edition_ids)}
+            matches = lines if matches is None else matches & lines
+            if not matches:
+                return []
+        edition_order = {edition_id: i for i, edition_id in enumerate(self.token_index.editions)}
+        order = lambda match: (edition_order[match[0]], match[1])
+        matches = sorted(matches, key=order)
+        if after is not None:
+            matches = matches[bisect_right(matches, order(after), key=order):]
+        return matches
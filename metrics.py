@@ -0,0 +1,344 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# WSGI environ key under which the app records the route that handled a request
+ROUTE_KEY = 'metrics.route'
+
+# Upper bounds of the histogram buckets, in seconds and in bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per combination of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        with self.lock:
+            self.values[tuple(labels)] += value
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    """A value that can go up and down, set directly."""
+
+    type = 'gauge'
+
+    def set(self, labels=(), value=0):
+        with self.lock:
+            self.values[tuple(labels)] = value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels=(), value=0):
+        labels = tuple(labels)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {labels: (list(buckets), total, count) for labels, (buckets, total, count) in self.values.items()}
+        for labels, (buckets, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labels, labels, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {count}"
+
+
+class Metrics:
+    """In-process request metrics, rendered in the Prometheus text format.
+
+    Every worker process keeps its own registry. Besides its own metrics,
+    ``render`` asks each registered collector for (name, help, type,
+    samples) at scrape time, for statistics kept elsewhere such as cache
+    hit counts. Database queries and template renders are also summed per
+    request in thread-local state, so the middleware can charge them to
+    the route that caused them.
+    """
+
+    def __init__(self, prefix='hamlet'):
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors = []
+        self.local = threading.local()
+        self.started = time.perf_counter()
+
+        self.requests = self.counter('requests_total', "Requests handled.", ('route', 'method', 'status'))
+        self.request_seconds = self.histogram('request_duration_seconds', "Time to handle a request and send its body.", ('route', 'method'))
+        self.response_bytes = self.histogram('response_size_bytes', "Size of response bodies.", ('route',), SIZE_BUCKETS)
+        self.db_seconds = self.histogram('db_query_duration_seconds', "Time spent in single database statements.", ('operation',))
+        self.template_seconds = self.histogram('template_render_duration_seconds', "Time to render a template.", ('template',))
+        self.route_db_queries = self.counter('route_db_queries_total', "Database statements run while handling a route.", ('route',))
+        self.route_db_seconds = self.counter('route_db_seconds_total', "Time in database statements while handling a route.", ('route',))
+        self.route_template_seconds = self.counter('route_template_seconds_total', "Time rendering templates while handling a route.", ('route',))
+        self.startup_seconds = self.gauge('startup_duration_seconds', "Time this worker spent loading each part of the corpus at startup.", ('phase',))
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(f"{self.prefix}_{name}", help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(f"{self.prefix}_{name}", help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(f"{self.prefix}_{name}", help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """Register a function returning (name, help, type, samples) tuples at scrape time."""
+        self.collectors.append(collect)
+        return collect
+
+    def mark_startup(self, phase):
+        """Record the time since the previous mark as the duration of a startup phase."""
+        now = time.perf_counter()
+        self.startup_seconds.set((phase,), now - self.started)
+        self.started = now
+
+    def begin_request(self):
+        self.local.db_queries = 0
+        self.local.db_seconds = 0.0
+        self.local.template_seconds = 0.0
+
+    def observe_query(self, statement, seconds):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+        self.db_seconds.observe((operation,), seconds)
+        if hasattr(self.local, 'db_queries'):
+            self.local.db_queries += 1
+            self.local.db_seconds += seconds
+
+    def start_template(self):
+        starts = getattr(self.local, 'template_starts', None)
+        if starts is None:
+            starts = self.local.template_starts = []
+        starts.append(time.perf_counter())
+
+    def end_template(self, template):
+        starts = getattr(self.local, 'template_starts', None)
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        self.template_seconds.observe((template,), seconds)
+        if hasattr(self.local, 'template_seconds'):
+            self.local.template_seconds += seconds
+
+    def end_request(self, route, method, status, seconds, size):
+        self.requests.inc((route, method, status))
+        self.request_seconds.observe((route, method), seconds)
+        self.response_bytes.observe((route,), size)
+        if hasattr(self.local, 'db_queries'):
+            self.route_db_queries.inc((route,), self.local.db_queries)
+            self.route_db_seconds.inc((route,), self.local.db_seconds)
+            self.route_template_seconds.inc((route,), self.local.template_seconds)
+            del self.local.db_queries, self.local.db_seconds, self.local.template_seconds
+
+    def render(self):
+        lines = []
+        families = [(metric.name, metric.help, metric.type, metric.samples()) for metric in self.metrics]
+        for collect in self.collectors:
+            families.extend(collect())
+        for name, help, metric_type, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def stats_collector(prefix, description, stats):
+    """Collector exposing the numeric values of a ``stats()`` dict as gauges."""
+    def collect():
+        return [
+            (f"{prefix}_{key}", f"{description}: {key.replace('_', ' ')}.", 'gauge', [f"{prefix}_{key} {_number(value)}"])
+            for key, value in stats().items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        ]
+    return collect
+
+
+def fold_stack(frame):
+    """A frame's call stack in the folded format of flame graph tools, root first."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        names.append(f"{module}:{code.co_name}".replace(';', ':').replace(' ', '_'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.stacks
+
+
+class SamplingProfiler:
+    """Opt-in per-request profiler writing folded stacks of slow requests.
+
+    A request is sampled when it carries the ``header`` (with the value
+    ``token``, if one is set). If it then takes at least ``min_duration``
+    seconds, the sampled stacks are written to a ``.folded`` file in
+    ``directory``, ready for flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, directory, header='X-Profile', token=None, interval=0.005, min_duration=0.1):
+        self.directory = directory
+        self.environ_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.token = token
+        self.interval = interval
+        self.min_duration = min_duration
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, environ):
+        value = environ.get(self.environ_key)
+        if value is None or (self.token and value != self.token):
+            return None
+        return StackSampler(threading.get_ident(), self.interval)
+
+    def finish(self, sampler, environ, seconds):
+        stacks = sampler.stop()
+        if seconds < self.min_duration or not stacks:
+            return None
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_') or 'index'
+        path = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{int(seconds * 1000)}ms-{slug[:80]}.folded"
+        )
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class MetricsMiddleware:
+    """WSGI middleware timing every request until its body has been sent.
+
+    The route label is read from ``environ[ROUTE_KEY]``, set by the app
+    once it has matched the request; requests answered before reaching
+    the app (static files) are labelled ``static``.
+    """
+
+    def __init__(self, app, metrics, profiler=None):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        self.metrics.begin_request()
+        sampler = self.profiler.start(environ) if self.profiler else None
+        status = []
+
+        def record_status(status_line, headers, exc_info=None):
+            status[:] = [status_line.split(' ', 1)[0]]
+            return start_response(status_line, headers, exc_info)
+
+        def finish(size):
+            seconds = time.perf_counter() - start
+            route = environ.get(ROUTE_KEY, 'static')
+            self.metrics.end_request(route, environ.get('REQUEST_METHOD', ''), status[0] if status else '500', seconds, size)
+            if sampler is not None:
+                self.profiler.finish(sampler, environ, seconds)
+
+        try:
+            body = self.app(environ, record_status)
+        except Exception:
+            finish(0)
+            raise
+        return MeasuredBody(body, finish)
+
+
+class MeasuredBody:
+    """Response body iterable that counts the bytes sent and reports them on close."""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.on_close(self.size)
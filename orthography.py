@@ -0,0 +1,125 @@
+from collections import Counter
+from functools import lru_cache
+
+from token_index import normalize_token
+
+# How a query term is matched against the vocabulary: only itself, every
+# spelling that normalizes to the same form, or those plus close misspellings
+SPELLING_MODES = ('exact', 'variants', 'fuzzy')
+
+# Length of the character n-grams indexed for fuzzy lookups
+GRAM_SIZE = 3
+
+
+def normalize_spelling(term):
+    """Early-modern spelling key of a normalized term.
+
+    Long s becomes s, vv becomes w, then v becomes u and j becomes i: the
+    letters were not yet distinguished, so "vpon" and "upon", "haue" and
+    "have", "iust" and "just" or "vvhat" and "what" share a key.
+    """
+    return term.replace('ſ', 's').replace('vv', 'w').replace('v', 'u').replace('j', 'i')
+
+
+def fold_final_e(key):
+    """A spelling key without the final e of words of four letters or more ("deare", "sonne").
+
+    Too loose for variant lookups, where it would merge "the" and "thee" or
+    "her" and "here", but fine for fuzzy matching and line similarity.
+    """
+    if len(key) > 3 and key.endswith('e'):
+        return key[:-1]
+    return key
+
+
+def max_distance(key):
+    """Edits allowed between a spelling key and its fuzzy matches: none for short words."""
+    if len(key) >= 9:
+        return 2
+    if len(key) >= 5:
+        return 1
+    return 0
+
+
+def grams(key):
+    """Character n-grams of a key, padded so that its first and last letters count fully."""
+    padded = '^' * (GRAM_SIZE - 1) + key + '$' * (GRAM_SIZE - 1)
+    return [padded[i:i + GRAM_SIZE] for i in range(len(padded) - GRAM_SIZE + 1)]
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of two strings, or ``limit + 1`` once it is known to exceed ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class SpellingIndex:
+    """Spelling variants of every vocabulary term, with a trigram index for fuzzy lookups.
+
+    Terms are grouped by their normalized spelling key. The distinct keys
+    are indexed by their character trigrams; a fuzzy lookup only computes
+    edit distances for keys sharing enough trigrams with the query to be
+    within reach (``k`` edits destroy at most ``3 * k`` trigrams), so it
+    never scans the whole vocabulary. Expansions are cached per query.
+    """
+
+    def __init__(self, vocabulary, cache_size=4096):
+        self.keys = []
+        self.key_ids = {}
+        self.key_terms = []
+        for term in vocabulary:
+            key = normalize_spelling(term)
+            key_id = self.key_ids.get(key)
+            if key_id is None:
+                key_id = self.key_ids[key] = len(self.keys)
+                self.keys.append(key)
+                self.key_terms.append([])
+            self.key_terms[key_id].append(term)
+
+        self.gram_postings = {}
+        for key_id, key in enumerate(self.keys):
+            for gram in set(grams(key)):
+                self.gram_postings.setdefault(gram, []).append(key_id)
+
+        self.expand = lru_cache(maxsize=cache_size)(self._expand)
+
+    def candidates(self, key, distance):
+        """Ids of the keys that may be within ``distance`` edits of a key."""
+        key_grams = set(grams(key))
+        shared = Counter()
+        for gram in key_grams:
+            shared.update(self.gram_postings.get(gram, ()))
+        needed = len(key_grams) - GRAM_SIZE * distance
+        return [key_id for key_id, count in shared.items() if count >= needed]
+
+    def _expand(self, term, mode='variants'):
+        """Vocabulary terms matching a query term in a spelling mode, sorted."""
+        term = normalize_token(term)
+        if mode == 'exact' or not term:
+            return [term]
+        key = normalize_spelling(term)
+        if mode == 'fuzzy':
+            # Spellings with or without a final e, plus those within the allowed edits
+            folded = fold_final_e(key)
+            key_ids = {self.key_ids.get(other) for other in (key, folded, folded + 'e') if fold_final_e(other) == folded}
+            distance = max_distance(key)
+            if distance:
+                key_ids.update(
+                    key_id for key_id in self.candidates(key, distance)
+                    if edit_distance(key, self.keys[key_id], distance) <= distance
+                )
+        else:
+            key_ids = {self.key_ids.get(key)}
+        matches = {term for key_id in key_ids if key_id is not None for term in self.key_terms[key_id]}
+        # Keep the query itself so an unknown spelling still behaves like an exact search
+        matches.add(term)
+        return sorted(matches)
@@ -0,0 +1,311 @@
+import os
+import glob
+import argparse
+from lxml import etree
+import json
+import re
+from collections import defaultdict
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from token_index import TokenIndex
+from corpus import write_corpus
+from variant_store import VariantStore, file_hash
+from apparatus import ApparatusStore
+
+# Define the data folder containing TEI XML files
+data_folder = 'data'
+
+# Per-edition extraction results and the manifest of the sources they came from
+build_folder = 'build'
+editions_folder = os.path.join(build_folder, 'editions')
+manifest_path = os.path.join(build_folder, 'manifest.json')
+
+# Outputs that are rebuilt whenever an edition changes
+output_files = ['corpus.bin', 'texts_data.json', 'token_index.json', 'interaction_data.json', 'variants.db', 'apparatus.db']
+
+TEI = '{http://www.tei-c.org/ns/1.0}'
+
+# Bumped whenever the layout of the per-edition cache files changes
+CACHE_VERSION = 2
+
+# How character interactions are counted from the speeches of a scene:
+#   scene   - every pair of characters who speak in the same scene, once per scene
+#   turns   - speakers of adjacent speeches, once per speech
+#   window  - speakers within a sliding window of speeches, once per speech
+INTERACTION_MODES = ['scene', 'turns', 'window']
+
+# Separators between the speakers of a shared speech, e.g. who="#hor, mar, bar"
+SPEAKER_SEPARATOR = re.compile(r'[\s,]+')
+
+def edition_cache_path(edition_id):
+    return os.path.join(editions_folder, f"{edition_id}.json")
+
+def split_speakers(who):
+    """Normalized names of every character a ``who`` attribute refers to."""
+    if not who:
+        return []
+    speakers = []
+    for name in SPEAKER_SEPARATOR.split(who):
+        name = name.strip('#').upper()
+        if name and name not in speakers:
+            speakers.append(name)
+    return speakers
+
+def count_interactions(speeches, mode='scene', window=3):
+    """Count interactions between characters in one pass over the speeches.
+
+    ``speeches`` lists the (act, scene, speakers) of every speech in reading
+    order. Each unordered pair is keyed by its sorted names joined with '-'.
+    In 'scene' mode a pair counts once per scene both characters speak in.
+    In 'turns' and 'window' modes each speech pairs its speakers with each
+    other and with the speakers of the previous one (turns) or previous
+    ``window - 1`` (window) speeches of the same scene, counting each pair at
+    most once per speech.
+    """
+    if mode not in INTERACTION_MODES:
+        raise ValueError(f"Unknown interaction mode: {mode}")
+    span = 2 if mode == 'turns' else window
+    counts = defaultdict(int)
+    current_scene = None
+    in_scene = set()
+    recent = []
+
+    def close_scene():
+        if mode == 'scene':
+            for pair in combinations(sorted(in_scene), 2):
+                counts['-'.join(pair)] += 1
+
+    for act, scene, speakers in speeches:
+        if (act, scene) != current_scene:
+            close_scene()
+            current_scene = (act, scene)
+            in_scene = set()
+            recent = []
+        if mode == 'scene':
+            in_scene.update(speakers)
+            continue
+        pairs = set(combinations(sorted(speakers), 2))
+        for previous in recent:
+            pairs.update(tuple(sorted((a, b))) for a in speakers for b in previous if a != b)
+        for pair in pairs:
+            counts['-'.join(pair)] += 1
+        recent.append(speakers)
+        if len(recent) > span - 1:
+            recent.pop(0)
+    close_scene()
+    return dict(counts)
+
+def parse_edition(xml_file):
+    """Extract the lines and speeches of one TEI file.
+
+    The file is streamed with iterparse; speeches and divisions are cleared
+    once they have been read, so memory stays flat regardless of file size.
+    The result is written to the edition's cache file in the build folder.
+    """
+    # Get edition identifier from the file name
+    edition_id = os.path.splitext(os.path.basename(xml_file))[0]
+
+    metadata = {'title': None, 'author': None, 'date': None}
+    metadata_tags = {TEI + 'docAuthor': 'author', TEI + 'docDate': 'date'}
+    lines = []
+    speeches = []
+
+    act_number = scene_number = speaker_name = None
+    act_depth = scene_depth = speech_depth = 0
+
+    for event, elem in etree.iterparse(xml_file, events=('start', 'end'), recover=True):
+        tag = elem.tag
+        if event == 'start':
+            if tag == TEI + 'div1' and elem.get('type') == 'act':
+                act_number = elem.get('n')
+                act_depth += 1
+            elif tag == TEI + 'div2' and elem.get('type') == 'scene' and act_depth:
+                scene_number = elem.get('n')
+                scene_depth += 1
+            elif tag == TEI + 'sp' and scene_depth:
+                who = elem.get('who')
+                speaker_name = who.strip('#') if who else ''
+                speaker_name = speaker_name.strip().upper()  # Normalize character name
+                # Record every character of a shared speech for the interaction counts
+                speakers = split_speakers(who)
+                if speakers:
+                    speeches.append((act_number, scene_number, speakers))
+                speech_depth += 1
+            continue
+
+        if tag == TEI + 'l' and speech_depth:
+            # Get the line spoken
+            lines.append((act_number, scene_number, speaker_name, elem.get('n'), ''.join(elem.itertext())))
+        elif tag == TEI + 'titlePart' and elem.get('type') == 'main' and metadata['title'] is None:
+            metadata['title'] = ''.join(elem.itertext())
+        elif tag in metadata_tags and metadata[metadata_tags[tag]] is None:
+            metadata[metadata_tags[tag]] = ''.join(elem.itertext())
+        elif tag == TEI + 'sp' and speech_depth:
+            speech_depth -= 1
+        elif tag == TEI + 'div2' and elem.get('type') == 'scene' and scene_depth:
+            scene_depth -= 1
+        elif tag == TEI + 'div1' and elem.get('type') == 'act' and act_depth:
+            act_depth -= 1
+
+        # Free speeches and divisions once read, along with their read siblings
+        if tag in (TEI + 'sp', TEI + 'div1', TEI + 'div2'):
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    # Metadata may follow the text, so it is attached once the file is read
+    lines = [
+        {
+            'edition': edition_id,
+            'title': metadata['title'] or '',
+            'author': metadata['author'] or '',
+            'date': metadata['date'] or '',
+            'act': act_number,
+            'scene': scene_number,
+            'speaker': speaker_name,
+            'line_number': line_number,
+            'text': line_text
+        }
+        for act_number, scene_number, speaker_name, line_number, line_text in lines
+    ]
+    with open(edition_cache_path(edition_id), 'w', encoding='utf-8') as f:
+        json.dump({'lines': lines, 'speeches': speeches}, f,
+                  ensure_ascii=False, separators=(',', ':'))
+    return edition_id
+
+def load_edition(edition_id):
+    with open(edition_cache_path(edition_id), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def build_collations(editions, hashes, force=False):
+    """Collate the pairs of editions and cluster their lines, where the stored results are stale."""
+    computed = VariantStore('variants.db').build(editions, hashes, force=force)
+    if computed:
+        print(f"Collated {computed} edition pairs.")
+
+    # Cluster corresponding lines across all editions for the apparatus
+    clusters = ApparatusStore('apparatus.db').build(editions, hashes, force=force)
+    if clusters is not None:
+        print(f"Clustered the lines into {clusters} apparatus entries.")
+
+def write_interactions(edition_speeches, mode, window):
+    """Count the interactions of every edition and save them for the app."""
+    interaction_data_output = {
+        edition_id: count_interactions(speeches, mode, window)
+        for edition_id, speeches in edition_speeches.items()
+    }
+    with open('interaction_data.json', 'w', encoding='utf-8') as f:
+        json.dump(interaction_data_output, f, ensure_ascii=False, indent=4)
+
+def load_manifest():
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest):
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4)
+
+def source_unchanged(entry, xml_file, stat):
+    """Check a manifest entry against a source file, hashing only if its mtime or size changed."""
+    if not entry or entry.get('version') != CACHE_VERSION or not os.path.exists(edition_cache_path(entry['edition'])):
+        return False
+    if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+        return True
+    return entry['hash'] == file_hash(xml_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract texts and interactions from the TEI editions.")
+    parser.add_argument('--jobs', type=int, default=None, help="parser processes (default: one per CPU)")
+    parser.add_argument('--force', action='store_true', help="re-parse every edition and rebuild the stored collations and apparatus")
+    parser.add_argument('--interactions', choices=INTERACTION_MODES, default='scene',
+                        help="how character interactions are counted (default: scene)")
+    parser.add_argument('--window', type=int, default=3,
+                        help="speeches per window in window mode (default: 3)")
+    args = parser.parse_args()
+    if args.window < 2:
+        parser.error("--window must be at least 2")
+
+    os.makedirs(editions_folder, exist_ok=True)
+    manifest = load_manifest()
+
+    # Find all TEI XML files in the data folder and decide which ones need parsing
+    xml_files = sorted(glob.glob(os.path.join(data_folder, '*.xml')))
+    new_manifest = {}
+    changed_files = []
+    for xml_file in xml_files:
+        stat = os.stat(xml_file)
+        entry = manifest.get(xml_file)
+        if args.force or not source_unchanged(entry, xml_file, stat):
+            changed_files.append(xml_file)
+            entry = {
+                'edition': os.path.splitext(os.path.basename(xml_file))[0],
+                'hash': file_hash(xml_file),
+                'version': CACHE_VERSION,
+            }
+        new_manifest[xml_file] = dict(entry, mtime=stat.st_mtime, size=stat.st_size)
+
+    removed = set(manifest) - set(new_manifest)
+    outputs_missing = not all(os.path.exists(path) for path in output_files)
+    if not changed_files and not removed and not outputs_missing:
+        # Remember new mtimes so touched but unchanged files are not hashed again
+        if new_manifest != manifest:
+            save_manifest(new_manifest)
+        edition_data = {entry['edition']: load_edition(entry['edition']) for entry in new_manifest.values()}
+        # Stored collations may come from an older collation version
+        build_collations(
+            {edition_id: data['lines'] for edition_id, data in edition_data.items()},
+            {entry['edition']: entry['hash'] for entry in new_manifest.values()}
+        )
+        # Interactions depend on the counting options, so they are recounted from the cache
+        write_interactions(
+            {edition_id: data['speeches'] for edition_id, data in edition_data.items()},
+            args.interactions, args.window
+        )
+        print("All editions are up to date.")
+        return
+
+    # Parse the changed editions in parallel
+    if changed_files:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            for edition_id in executor.map(parse_edition, changed_files):
+                print(f"Parsed {edition_id}.")
+    for xml_file in removed:
+        cache_path = edition_cache_path(manifest[xml_file]['edition'])
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+    # Merge the per-edition results in file order
+    texts_data = []
+    edition_speeches = {}
+    for xml_file in xml_files:
+        edition_id = new_manifest[xml_file]['edition']
+        edition_data = load_edition(edition_id)
+        texts_data.extend(edition_data['lines'])
+        edition_speeches[edition_id] = edition_data['speeches']
+
+    # Save the extracted text data as the columnar corpus the app maps, and as JSON
+    write_corpus('corpus.bin', texts_data)
+    with open('texts_data.json', 'w', encoding='utf-8') as f:
+        json.dump(texts_data, f, ensure_ascii=False, separators=(',', ':'))
+
+    # Save the token index used by the word frequency and dispersion views
+    TokenIndex.build(texts_data).save('token_index.json')
+
+    # Collate every pair of editions whose sources changed since the last run
+    editions = defaultdict(list)
+    for entry in texts_data:
+        editions[entry['edition']].append(entry)
+    hashes = {entry['edition']: entry['hash'] for entry in new_manifest.values()}
+    build_collations(editions, hashes, force=args.force)
+
+    # Save the interaction counts to a JSON file
+    write_interactions(edition_speeches, args.interactions, args.window)
+
+    # Only record the sources once every output has been written
+    save_manifest(new_manifest)
+
+if __name__ == '__main__':
+    main()
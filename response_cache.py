@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# A rendered response body with its strong ETag
+CachedResponse = namedtuple('CachedResponse', ['etag', 'mimetype', 'created', 'body'])
+
+# Disk writes between two passes that trim the cache directory to its size limit
+PRUNE_INTERVAL = 50
+
+
+def cache_key(version, view, params):
+    """Key of a response: the corpus version, the view and its canonical parameters."""
+    payload = json.dumps([version, view, list(params.items())], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Rendered responses of the analytical views, bounded by count, size and age.
+
+    Entries live in an in-process LRU holding at most ``max_entries`` entries
+    and ``max_bytes`` bytes of bodies, and expire ``ttl`` seconds after they
+    were rendered. Any limit may be None. With a ``directory``, entries are
+    also written there, one file per key, so every worker serving the same
+    directory reuses what another one rendered; the directory is trimmed to
+    ``max_disk_bytes`` by dropping the oldest files. A ``max_entries`` of 0
+    disables the cache.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, directory=None, max_disk_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.enabled = max_entries != 0
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_writes = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry.created >= self.ttl
+
+    def get(self, key):
+        if not self.enabled:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._read(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, entry)
+        return entry
+
+    def put(self, key, body, mimetype='text/html'):
+        entry = CachedResponse(
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            mimetype=mimetype,
+            created=time.time(),
+            body=body
+        )
+        if self.enabled:
+            with self.lock:
+                self._store(key, entry)
+            self._write(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        if key in self.cache:
+            self._remove(key)
+        self.cache[key] = entry
+        self.cached_bytes += len(entry.body)
+        # Always keep the newest entry, even if it is over the limit
+        while len(self.cache) > 1 and (
+            (self.max_entries is not None and len(self.cache) > self.max_entries) or
+            (self.max_bytes is not None and self.cached_bytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self.cache)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.cache.pop(key)
+        self.cached_bytes -= len(entry.body)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.cache")
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                header = json.loads(f.readline())
+                body = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        entry = CachedResponse(header['etag'], header['mimetype'], header['created'], body)
+        return None if self._expired(entry) else entry
+
+    def _write(self, key, entry):
+        if not self.directory:
+            return
+        header = json.dumps({'etag': entry.etag, 'mimetype': entry.mimetype, 'created': entry.created})
+        # Write to a temporary file and rename it, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.encode('utf-8') + b'\n')
+            f.write(entry.body)
+        os.replace(tmp_path, self._path(key))
+        with self.lock:
+            self.disk_writes += 1
+            prune = self.disk_writes % PRUNE_INTERVAL == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Drop expired files, then the oldest ones until the directory fits its size limit."""
+        if not self.directory:
+            return
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.cache'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        for mtime, size, path in files:
+            expired = self.ttl is not None and now - mtime >= self.ttl
+            if not expired and (self.max_disk_bytes is None or total <= self.max_disk_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.cached_bytes = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith('.cache'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'cached_entries': len(self.cache),
+                'cached_bytes': self.cached_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'directory': self.directory,
+            }
@@ -0,0 +1,94 @@
+import json
+from collections import Counter
+
+# Punctuation stripped from both ends of a word before it is counted
+PUNCTUATION = '.,;:!?\'"()[]{}<>-_*&|/\\—–‘’“”'
+
+# Stream placeholder for words that are nothing but punctuation
+NO_TERM = -1
+
+
+def normalize_token(word):
+    """Lowercase a word and strip surrounding punctuation."""
+    return word.lower().strip(PUNCTUATION)
+
+
+def tokenize(text):
+    """Split a line on whitespace and normalize every word.
+
+    The result is aligned with ``text.split()``; punctuation-only words
+    normalize to an empty string.
+    """
+    return [normalize_token(word) for word in text.split()]
+
+
+class TokenIndex:
+    """Per-edition term counts and token streams for the whole corpus.
+
+    Every edition stores its words as one flat stream of vocabulary ids
+    (``NO_TERM`` for punctuation-only words) plus the offset at which each
+    line starts in that stream, so line ``i`` of an edition covers
+    ``tokens[line_offsets[i]:line_offsets[i + 1]]``.
+    """
+
+    def __init__(self, vocabulary, editions):
+        self.vocabulary = vocabulary
+        self.term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+        self.editions = {}
+        for edition_id, data in editions.items():
+            ranked = [(vocabulary[term_id], count) for term_id, count in data['counts']]
+            self.editions[edition_id] = {
+                'ranked': ranked,
+                'counts': dict(ranked),
+                'tokens': data['tokens'],
+                'line_offsets': data['line_offsets'],
+            }
+
+    @classmethod
+    def build(cls, texts_data):
+        # Tokenize every line once, keeping editions in corpus order
+        streams = {}
+        for entry in texts_data:
+            stream = streams.setdefault(entry['edition'], {'terms': [], 'line_offsets': [0]})
+            stream['terms'].extend(tokenize(entry['text']))
+            stream['line_offsets'].append(len(stream['terms']))
+
+        vocabulary = sorted({term for stream in streams.values() for term in stream['terms'] if term})
+        term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+
+        editions = {}
+        for edition_id, stream in streams.items():
+            counts = Counter(term for term in stream['terms'] if term)
+            editions[edition_id] = {
+                'counts': [[term_ids[term], count] for term, count in counts.most_common()],
+                'tokens': [term_ids[term] if term else NO_TERM for term in stream['terms']],
+                'line_offsets': stream['line_offsets'],
+            }
+        return cls(vocabulary, editions)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['vocabulary'], data['editions'])
+
+    def save(self, path):
+        editions = {}
+        for edition_id, data in self.editions.items():
+            editions[edition_id] = {
+                'counts': [[self.term_ids[term], count] for term, count in data['ranked']],
+                'tokens': data['tokens'],
+                'line_offsets': data['line_offsets'],
+            }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'vocabulary': self.vocabulary, 'editions': editions}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+
+    def most_common(self, edition_id, n):
+        return self.editions[edition_id]['ranked'][:n]
+
+    def count(self, edition_id, term):
+        return self.editions[edition_id]['counts'].get(normalize_token(term), 0)
+
+    def total_tokens(self, edition_id):
+        return len(self.editions[edition_id]['tokens'])
@@ -0,0 +1,182 @@
+import glob
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+from contextlib import closing
+from itertools import combinations
+
+from collation import collate, edition_tokens
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (
+    edition1 TEXT NOT NULL,
+    edition2 TEXT NOT NULL,
+    hash1 TEXT NOT NULL,
+    hash2 TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (edition1, edition2)
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    edition1 TEXT NOT NULL,
+    edition2 TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    act TEXT,
+    scene TEXT,
+    records TEXT NOT NULL,
+    PRIMARY KEY (edition1, edition2, position)
+);
+"""
+
+# Version of the stored collations. Bump it whenever collation.py, the record
+# layout or the line entries extracted by process_tei.py change, so pairs
+# computed by the old code are recollated instead of served.
+COLLATION_VERSION = 1
+
+# How a variant reads when the two editions are swapped
+SWAPPED_OPS = {'replace': 'replace', 'delete': 'insert', 'insert': 'delete'}
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hashes(data_folder):
+    """Content hash of every TEI file in the data folder, keyed by edition."""
+    return {
+        os.path.splitext(os.path.basename(xml_file))[0]: file_hash(xml_file)
+        for xml_file in sorted(glob.glob(os.path.join(data_folder, '*.xml')))
+    }
+
+
+def _swap(records):
+    swapped = []
+    for scene, i, j, variants in records:
+        if variants:
+            variants = [{'op': SWAPPED_OPS[v['op']], 'a': v['b'], 'b': v['a']} for v in variants]
+        swapped.append((scene, j, i, variants))
+    return swapped
+
+
+class VariantStore:
+    """Persistent store of precomputed collations for every pair of editions.
+
+    Collations are written by ``process_tei.py`` (or ``python variant_store.py``
+    to rebuild from an existing ``texts_data.json``) into an SQLite file, one row
+    per edition pair and scene. Each pair records the content hashes of the two
+    source XML files it was computed from and the COLLATION_VERSION; a pair
+    where either no longer matches is recomputed on the next build and
+    ignored by readers until then.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.executescript(SCHEMA)
+        # Stores written before pairs were versioned lack the column; their pairs count as stale
+        if 'version' not in [column[1] for column in connection.execute("PRAGMA table_info(pairs)")]:
+            connection.execute("ALTER TABLE pairs ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        return connection
+
+    def connect_readonly(self):
+        return sqlite3.connect(f"{pathlib.Path(self.path).resolve().as_uri()}?mode=ro", uri=True)
+
+    def get(self, edition1, edition2, hashes, first_scene=0):
+        """Return the stored collation of two editions, or None.
+
+        ``hashes`` maps editions to the content hashes of their current
+        source files; a pair computed from other sources counts as missing.
+        Records have the same shape as ``collation.collate`` returns; only
+        those of the scenes from position ``first_scene`` on are read.
+        """
+        if edition1 not in hashes or edition2 not in hashes or not os.path.exists(self.path):
+            return None
+        first, second = sorted([edition1, edition2])
+        try:
+            with closing(self.connect_readonly()) as connection:
+                row = connection.execute(
+                    "SELECT hash1, hash2, version FROM pairs WHERE edition1 = ? AND edition2 = ?",
+                    (first, second)
+                ).fetchone()
+                if row != (hashes[first], hashes[second], COLLATION_VERSION):
+                    return None
+                records = []
+                for act, scene, scene_records in connection.execute(
+                    "SELECT act, scene, records FROM scenes WHERE edition1 = ? AND edition2 = ? AND position >= ? "
+                    "ORDER BY position",
+                    (first, second, first_scene)
+                ):
+                    records.extend(((act, scene), i, j, variants) for i, j, variants in json.loads(scene_records))
+        except sqlite3.OperationalError:
+            # Not a variant store, or one written before pairs were versioned
+            return None
+        return records if first == edition1 else _swap(records)
+
+    def put(self, connection, edition1, edition2, hash1, hash2, records):
+        connection.execute("DELETE FROM scenes WHERE edition1 = ? AND edition2 = ?", (edition1, edition2))
+        # Group the records by scene, keeping the reading order of the scenes
+        by_scene = {}
+        for scene, i, j, variants in records:
+            by_scene.setdefault(scene, []).append([i, j, variants])
+        connection.executemany(
+            "INSERT INTO scenes (edition1, edition2, position, act, scene, records) VALUES (?, ?, ?, ?, ?, ?)",
+            [(edition1, edition2, position, act, scene, json.dumps(scene_records, ensure_ascii=False, separators=(',', ':')))
+             for position, ((act, scene), scene_records) in enumerate(by_scene.items())]
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO pairs (edition1, edition2, hash1, hash2, version) VALUES (?, ?, ?, ?, ?)",
+            (edition1, edition2, hash1, hash2, COLLATION_VERSION)
+        )
+
+    def build(self, editions, hashes, force=False):
+        """Collate every pair of editions whose sources or collation version changed since the last build.
+
+        ``editions`` maps edition ids to their lists of line entries. Pairs
+        of editions that no longer exist are removed; ``force`` recomputes
+        every pair. Returns the number of pairs that were (re)computed.
+        """
+        computed = 0
+        with closing(self.connect()) as connection:
+            stored = {
+                (edition1, edition2): (hash1, hash2)
+                for edition1, edition2, hash1, hash2 in connection.execute(
+                    "SELECT edition1, edition2, hash1, hash2 FROM pairs WHERE version = ?", (COLLATION_VERSION,)
+                )
+            }
+            for edition1, edition2 in connection.execute("SELECT edition1, edition2 FROM pairs").fetchall():
+                if edition1 not in editions or edition2 not in editions:
+                    connection.execute("DELETE FROM pairs WHERE edition1 = ? AND edition2 = ?", (edition1, edition2))
+                    connection.execute("DELETE FROM scenes WHERE edition1 = ? AND edition2 = ?", (edition1, edition2))
+            connection.commit()
+
+            # Every edition is collated against all the others; tokenize each once
+            tokens = {}
+            for edition1, edition2 in combinations(sorted(editions), 2):
+                pair_hashes = (hashes[edition1], hashes[edition2])
+                if not force and stored.get((edition1, edition2)) == pair_hashes:
+                    continue
+                for edition_id in (edition1, edition2):
+                    if edition_id not in tokens:
+                        tokens[edition_id] = edition_tokens(editions[edition_id])
+                records = collate(editions[edition1], editions[edition2], tokens[edition1], tokens[edition2])
+                self.put(connection, edition1, edition2, *pair_hashes, records)
+                connection.commit()
+                computed += 1
+        return computed
+
+
+if __name__ == '__main__':
+    with open('texts_data.json', 'r', encoding='utf-8') as f:
+        texts_data = json.load(f)
+    editions = {}
+    for entry in texts_data:
+        editions.setdefault(entry['edition'], []).append(entry)
+    computed = VariantStore('variants.db').build(editions, source_hashes('data'))
+    print(f"Collated {computed} edition pairs.")